@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import numpy as np
+
+
+# Bounded LRU cache of model outputs keyed by canonical Zobrist keys (HexBoard.canonical_key)
+# Outputs are stored for the canonical orientation, so a position and its 180 degree rotation share an entry
+# With symmetric=False the rotation is ignored and only the plain hash is used
+# version is an optional callable, e.g. lambda: agent.weights_version, the cache is cleared when it changes
+class QCache:
+
+    def __init__(self, model, max_size=100000, symmetric=True, version=None):
+        self.model = model
+        self.max_size = max_size
+        self.symmetric = symmetric
+        self.version = version
+        self.entries = OrderedDict()
+
+        self.seen_version = version() if version is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def invalidate(self):
+        self.entries.clear()
+        self.invalidations += 1
+
+    def check_version(self):
+        if self.version is not None:
+            version = self.version()
+            if version != self.seen_version:
+                self.seen_version = version
+                self.invalidate()
+
+    # Q values of a HexBoard, with the same shape as model(board.get_state())
+    def __call__(self, board):
+        if self.symmetric:
+            key, rotated = board.canonical_key()
+        else:
+            key, rotated = board.hash, False
+        return self.lookup(np.array([key], dtype=np.uint64), np.array([rotated]),
+                           lambda: board.get_state(copy=False))
+
+    # Q values of the boards of a VecHexBoard selected by mask
+    def batch(self, boards, mask):
+        if self.symmetric:
+            keys, rotated = boards.canonical_keys()
+        else:
+            keys, rotated = boards.hash, np.zeros(boards.n, dtype=bool)
+        return self.lookup(keys[mask], rotated[mask], lambda: boards.get_state()[mask].astype(np.float32))
+
+    # Q values for a batch of keys, the states of the misses are evaluated in a single model call
+    # states is a callable returning the stacked states, so they are only built when needed
+    def lookup(self, keys, rotated, states):
+        self.check_version()
+
+        q = []
+        misses = dict()  # first index of every missing key, later occurrences reuse its output
+        for idx, key in enumerate(keys.tolist()):
+            values = self.entries.get(key)
+            if values is None:
+                misses.setdefault(key, idx)
+                q.append(None)
+            else:
+                self.entries.move_to_end(key)
+                q.append(values[::-1] if rotated[idx] else values)
+
+        self.hits += len(q) - len(misses)
+        self.misses += len(misses)
+
+        if misses:
+            first = list(misses.values())
+            computed = np.asarray(self.model(np.asarray(states())[first]))
+
+            # Store in the canonical orientation, flattened positions are reversed by the rotation
+            fresh = {key: values[::-1].copy() if rotated[idx] else values.copy()
+                     for (key, idx), values in zip(misses.items(), computed)}
+            self.entries.update(fresh)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+            for idx, key in enumerate(keys.tolist()):
+                if q[idx] is None:
+                    q[idx] = fresh[key][::-1] if rotated[idx] else fresh[key]
+
+        return np.stack(q)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries),
+                'invalidations': self.invalidations}
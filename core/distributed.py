@@ -0,0 +1,290 @@
+import multiprocessing as mp
+import queue
+import time
+import traceback
+import numpy as np
+
+from core.hex import HexBoard
+
+
+# Episode functions run inside the workers
+# They get the worker's environment, a policy returning Q values and the current epsilon,
+# and return the transitions of one episode in the same format as DQNAgent.update_memory
+
+# Hex episode as in hex_script_0/1, every episode starts from an empty board of the size of env
+def hex_episode(env, policy, epsilon, reward=1, punishment=-1):
+    board = HexBoard(env.x, env.y)
+    grid_size = env.x * env.y
+    transitions = []
+
+    # Opponent beginns randomly
+    if np.random.randint(0, 2):
+        board.play(2, *board.get_xy(board.random_legal()))
+
+    finished = False
+    while not finished:
+        start_state = board.get_state()
+        if np.random.uniform() < epsilon:
+            move = np.random.randint(grid_size)
+
+        else:
+            move = np.argmax(policy(start_state))
+
+        board.play(1, *board.get_xy(move))
+        if board.crash:
+            finished = True
+            transitions.append([start_state, move, punishment, start_state, True])
+
+        elif board.is_full():
+            finished = True
+            transitions.append([start_state, move, reward, board.get_state(), True])
+
+        else:
+            board.play(2, *board.get_xy(board.random_legal()))
+            finished = board.is_full()
+            transitions.append([start_state, move, reward, board.get_state(), finished])
+
+    return transitions
+
+
+# BooleanToy episode as in toy_script_0
+def toy_episode(env, policy, epsilon, max_score=400, max_moves=300):
+    env.reset()
+    transitions = []
+
+    finished = False
+    while not finished:
+        start_state = env.get_state_from_board()
+        if np.random.uniform() < epsilon:
+            act = np.random.randint(env.action_shape[0])
+
+        else:
+            act = np.argmax(policy(start_state))
+
+        reward = env.step(act)
+        transitions.append([start_state, act, reward, env.get_state_from_board(), env.game_over])
+        finished = env.game_over or env.score >= max_score or env.frames_counter >= max_moves
+
+    return transitions
+
+
+# Gym episode as in gym_script_0
+def gym_episode(env, policy, epsilon, episode_length=200):
+    observation = env.reset()
+    transitions = []
+
+    for i_episode in range(episode_length):
+        if np.random.uniform() < epsilon:
+            action = env.action_space.sample()
+
+        else:
+            action = np.argmax(policy(observation.reshape((1, -1))))
+
+        new_observation, reward, stop, _ = env.step(action)
+        transitions.append([observation.reshape((1, -1)), action, reward, new_observation.reshape((1, -1)), stop])
+        observation = new_observation
+
+        if stop:
+            break
+
+    return transitions
+
+
+# Failures are reported to the learner through errors_queue before the worker exits
+def actor_process(worker_id, make_env, episode_fn, model_json, epsilon_array, num_episodes,
+                  episode_counter, weights_queue, transitions_queue, errors_queue, stop_event):
+    try:
+        actor_loop(worker_id, make_env, episode_fn, model_json, epsilon_array, num_episodes,
+                   episode_counter, weights_queue, transitions_queue, stop_event)
+    except Exception:
+        errors_queue.put((worker_id, traceback.format_exc()))
+        raise
+
+
+def actor_loop(worker_id, make_env, episode_fn, model_json, epsilon_array, num_episodes,
+               episode_counter, weights_queue, transitions_queue, stop_event):
+
+    # Each worker is a single-threaded TensorFlow process
+    import tensorflow as tf
+    from tensorflow import keras
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    model = keras.models.model_from_json(model_json)
+    version = -1
+    env = make_env()
+    np.random.seed((worker_id * 7919 + int(time.time())) % 2 ** 32)
+
+    forward = tf.function(lambda states: model(states, training=False),
+                          input_signature=[tf.TensorSpec(model.input_shape, tf.float32)])
+
+    def policy(state):
+        return forward(np.asarray(state, dtype=np.float32).reshape((-1, *model.input_shape[1:]))).numpy()
+
+    while not stop_event.is_set():
+
+        # Pick up the latest weights published by the learner
+        try:
+            version, weights = weights_queue.get(block=version < 0, timeout=1)
+            model.set_weights(weights)
+        except queue.Empty:
+            if version < 0:
+                continue
+
+        with episode_counter.get_lock():
+            episode = episode_counter.value
+            episode_counter.value += 1
+
+        if episode >= num_episodes:
+            break
+
+        transitions = episode_fn(env, policy, epsilon_array[min(episode, len(epsilon_array) - 1)])
+
+        # Bounded queue, wait for the learner unless we are asked to stop
+        while not stop_event.is_set():
+            try:
+                transitions_queue.put((worker_id, version, episode, transitions), timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+
+# Learner owning the DQNAgent, fed with transitions by worker processes running their own environments
+# train_ratio is the number of training steps per received transition, 1 as in the sequential scripts
+# The learner waits for transitions when it is ahead, and the bounded queue holds the workers back when it is behind
+class ActorLearner:
+
+    def __init__(self, agent, make_env, episode_fn, num_workers, epsilon_array,
+                 sync_period=64, queue_size=256, train_ratio=1.0):
+        self.agent = agent
+        self.make_env = make_env
+        self.episode_fn = episode_fn
+        self.num_workers = num_workers
+        self.epsilon_array = np.asarray(epsilon_array)
+        self.sync_period = sync_period
+        self.train_ratio = train_ratio
+
+        # Workers are spawned so they do not inherit the TensorFlow state of the learner
+        self.context = mp.get_context('spawn')
+        self.transitions_queue = self.context.Queue(maxsize=queue_size)
+        self.weights_queues = [self.context.Queue(maxsize=1) for _ in range(num_workers)]
+        self.errors_queue = self.context.Queue()
+        self.episode_counter = self.context.Value('i', 0)
+        self.stop_event = self.context.Event()
+        self.workers = []
+
+        self.version = 0
+        self.metrics = {'episodes': 0, 'transitions': 0, 'train_steps': 0, 'transitions_per_second': 0.0,
+                        'train_steps_per_second': 0.0, 'queue_depth': 0, 'weight_staleness': 0.0}
+
+    # Send the online weights to every worker, replacing weights they have not picked up yet
+    def publish_weights(self):
+        weights = self.agent.online.get_weights()
+        for weights_queue in self.weights_queues:
+            try:
+                weights_queue.get_nowait()
+            except queue.Empty:
+                pass
+            weights_queue.put((self.version, weights))
+        self.version += 1
+
+    def start(self, num_episodes):
+        self.publish_weights()
+        model_json = self.agent.online.to_json()
+        for worker_id in range(self.num_workers):
+            worker = self.context.Process(target=actor_process,
+                                          args=(worker_id, self.make_env, self.episode_fn, model_json,
+                                                self.epsilon_array, num_episodes, self.episode_counter,
+                                                self.weights_queues[worker_id], self.transitions_queue,
+                                                self.errors_queue, self.stop_event),
+                                          daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        self.stop_event.set()
+
+        # Drain the queue so no worker stays blocked on it
+        for worker in self.workers:
+            while worker.is_alive():
+                try:
+                    self.transitions_queue.get(timeout=0.1)
+                except queue.Empty:
+                    worker.join(timeout=0.1)
+        self.workers = []
+
+    # Raise the failure of any worker that died, otherwise its episodes would be waited for forever
+    def check_workers(self):
+        for worker_id, worker in enumerate(self.workers):
+            if not worker.is_alive() and worker.exitcode != 0:
+                try:
+                    failed_id, error = self.errors_queue.get(timeout=1)
+                except queue.Empty:
+                    failed_id, error = worker_id, f"exit code {worker.exitcode}"
+                raise Exception(f"Worker {failed_id} failed:\n{error}")
+
+    def queue_depth(self):
+        try:
+            return self.transitions_queue.qsize()
+        except NotImplementedError:
+            return -1
+
+    # Move every episode waiting in the queue into the replay memory
+    def receive(self, block):
+        received = 0
+        staleness = []
+        while True:
+            try:
+                worker_id, version, episode, transitions = self.transitions_queue.get(block=block and not received,
+                                                                                      timeout=0.1)
+            except queue.Empty:
+                break
+
+            for transition in transitions:
+                self.agent.update_memory(transition)
+            received += len(transitions)
+            staleness.append(self.version - 1 - version)
+            self.metrics['episodes'] += 1
+
+        if staleness:
+            self.metrics['weight_staleness'] = float(np.mean(staleness))
+        self.metrics['transitions'] += received
+
+    def run(self, num_episodes, log_period=10.0):
+        self.start(num_episodes)
+        start = last_log = time.perf_counter()
+        try:
+            while True:
+                self.check_workers()
+
+                # Train while behind train_ratio, keep going after the last episode until the target is met
+                episodes_done = self.metrics['episodes'] >= num_episodes
+                behind = (self.metrics['train_steps'] < self.train_ratio * self.metrics['transitions']
+                          and len(self.agent.replay_memory) >= self.agent.minimum_memory_size)
+                if episodes_done and not behind:
+                    break
+
+                # Only wait for workers while there is nothing to train on
+                if not episodes_done:
+                    self.receive(block=not behind)
+
+                if behind and self.agent.train():
+                    self.metrics['train_steps'] += 1
+                    if not self.metrics['train_steps'] % self.sync_period:
+                        self.publish_weights()
+
+                now = time.perf_counter()
+                self.metrics['queue_depth'] = self.queue_depth()
+                self.metrics['transitions_per_second'] = self.metrics['transitions'] / (now - start)
+                self.metrics['train_steps_per_second'] = self.metrics['train_steps'] / (now - start)
+                if log_period and now - last_log >= log_period:
+                    last_log = now
+                    print(f"Episodes: {self.metrics['episodes']}, Transitions/s: "
+                          f"{self.metrics['transitions_per_second']:.1f}, Steps/s: "
+                          f"{self.metrics['train_steps_per_second']:.1f}, Queue: {self.metrics['queue_depth']}, "
+                          f"Staleness: {self.metrics['weight_staleness']:.1f}, Loss: {self.agent.loss[-1]}")
+
+        finally:
+            self.stop()
+
+        return self.metrics
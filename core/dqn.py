@@ -1,50 +1,313 @@
+import tensorflow as tf
 from tensorflow import keras
-from collections import deque
 import numpy as np
-from random import sample
+import json
+import os
+from types import SimpleNamespace
 
+from core.timing import timer, timed
 
-class DQNCallback(keras.callbacks.Callback):
 
-    loss = ['unavailable']
+# Fixed-capacity ring buffer of transitions stored column by column
+class ReplayMemory:
 
-    def on_epoch_end(self, batch, logs=None):
-        self.loss.append(logs["loss"])
+    def __init__(self, capacity, state_shape, batch_size):
+        self.capacity = capacity
+        self.state_shape = tuple(state_shape)
+        self.batch_size = batch_size
+        self.size = 0
+        self.position = 0
 
+        # State columns are allocated on the first transition, so they keep the dtype of the environment
+        self.start_states = None
+        self.end_states = None
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.terminals = np.zeros(capacity, dtype=bool)
 
+        # Reusable batch arrays, overwritten by every call to sample
+        self.batch_start_states = None
+        self.batch_end_states = None
+        self.batch_actions = np.zeros(batch_size, dtype=np.int64)
+        self.batch_rewards = np.zeros(batch_size, dtype=np.float32)
+        self.batch_terminals = np.zeros(batch_size, dtype=bool)
+        self.batch_indices = np.zeros(batch_size, dtype=np.int64)
+
+        # Importance-sampling weights of the last batch, uniform sampling needs no correction
+        self.batch_weights = np.ones(batch_size, dtype=np.float32)
+
+    def __len__(self):
+        return self.size
+
+    def allocate(self, dtype):
+        self.start_states = np.zeros((self.capacity, *self.state_shape), dtype=dtype)
+        self.end_states = np.zeros((self.capacity, *self.state_shape), dtype=dtype)
+        self.batch_start_states = np.zeros((self.batch_size, *self.state_shape), dtype=dtype)
+        self.batch_end_states = np.zeros((self.batch_size, *self.state_shape), dtype=dtype)
+
+    def append(self, transition):
+        start_state, action, reward, end_state, end_game = transition
+        start_state = np.asarray(start_state)
+        if self.start_states is None:
+            self.allocate(start_state.dtype)
+
+        self.start_states[self.position] = start_state.reshape(self.state_shape)
+        self.end_states[self.position] = np.asarray(end_state).reshape(self.state_shape)
+        self.actions[self.position] = action
+        self.rewards[self.position] = reward
+        self.terminals[self.position] = end_game
+
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    # Draw a batch of indices with replacement and gather the columns into the batch arrays
+    def sample(self):
+        self.batch_indices[:] = np.random.randint(self.size, size=self.batch_size)
+        return self.gather()
+
+    def gather(self):
+        np.take(self.start_states, self.batch_indices, axis=0, out=self.batch_start_states)
+        np.take(self.end_states, self.batch_indices, axis=0, out=self.batch_end_states)
+        np.take(self.actions, self.batch_indices, out=self.batch_actions)
+        np.take(self.rewards, self.batch_indices, out=self.batch_rewards)
+        np.take(self.terminals, self.batch_indices, out=self.batch_terminals)
+
+        return (self.batch_start_states, self.batch_actions, self.batch_rewards,
+                self.batch_end_states, self.batch_terminals)
+
+    # Nothing to persist, an in-memory buffer does not survive the process
+    def flush(self):
+        pass
+
+
+# Replay memory whose columns are memory-mapped files in path, so it can outgrow RAM and survive restarts
+# The size and position are only persisted by flush, reopening the directory resumes from the last flush
+class MemmapReplayMemory(ReplayMemory):
+
+    def __init__(self, capacity, state_shape, batch_size, path):
+        super().__init__(capacity, state_shape, batch_size)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        self.actions = self.open_column('actions', np.int64, (capacity, ))
+        self.rewards = self.open_column('rewards', np.float32, (capacity, ))
+        self.terminals = self.open_column('terminals', bool, (capacity, ))
+
+        meta_file = os.path.join(path, 'memory.json')
+        if os.path.exists(meta_file):
+            with open(meta_file) as file:
+                meta = json.load(file)
+
+            if meta['capacity'] != capacity or tuple(meta['state_shape']) != self.state_shape:
+                raise Exception(f"Replay memory in {path} has capacity {meta['capacity']} and state shape "
+                                f"{meta['state_shape']}, expected {capacity} and {self.state_shape}")
+
+            self.size = meta['size']
+            self.position = meta['position']
+            if meta['dtype'] is not None:
+                self.allocate(meta['dtype'])
+
+    def open_column(self, name, dtype, shape):
+        file = os.path.join(self.path, name + '.dat')
+        return np.memmap(file, dtype=dtype, mode='r+' if os.path.exists(file) else 'w+', shape=shape)
+
+    def allocate(self, dtype):
+        self.start_states = self.open_column('start_states', dtype, (self.capacity, *self.state_shape))
+        self.end_states = self.open_column('end_states', dtype, (self.capacity, *self.state_shape))
+        self.batch_start_states = np.zeros((self.batch_size, *self.state_shape), dtype=dtype)
+        self.batch_end_states = np.zeros((self.batch_size, *self.state_shape), dtype=dtype)
+
+    def flush(self):
+        columns = [self.actions, self.rewards, self.terminals]
+        if self.start_states is not None:
+            columns += [self.start_states, self.end_states]
+        for column in columns:
+            column.flush()
+
+        meta = {'capacity': self.capacity,
+                'state_shape': self.state_shape,
+                'size': self.size,
+                'position': self.position,
+                'dtype': None if self.start_states is None else self.start_states.dtype.str}
+        write_atomic(os.path.join(self.path, 'memory.json'), lambda file: file.write(json.dumps(meta).encode()))
+
+
+# Write through a temporary file, so a crash never leaves a half-written file behind
+def write_atomic(file_name, write):
+    with open(file_name + '.tmp', 'wb') as file:
+        write(file)
+    os.replace(file_name + '.tmp', file_name)
+
+
+# Binary tree over the leaf priorities where every node holds the sum of its children
+# Leaves live at [leaves, 2 * leaves) and the root at index 1
+class SumTree:
+
+    def __init__(self, capacity):
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.leaves
+        self.tree[nodes] = priorities
+
+        # Refresh the sums one level at a time, for the whole batch at once
+        nodes = np.unique(nodes // 2)
+        while nodes[0] > 0:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    # Leaf indices whose cumulative priority range contains each of the values
+    def find(self, values):
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.leaves:
+            left = 2 * nodes
+            go_right = values >= self.tree[left]
+            values = values - self.tree[left] * go_right
+            nodes = left + go_right
+        return nodes - self.leaves
+
+
+# Replay memory sampling transitions proportionally to their TD error
+class PrioritizedReplayMemory(ReplayMemory):
+
+    def __init__(self, capacity, state_shape, batch_size, alpha=0.6, beta=0.4, beta_steps=100000, epsilon=1e-3):
+        super().__init__(capacity, state_shape, batch_size)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1 - beta) / beta_steps if beta_steps else 0
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+
+    # New transitions get the highest priority seen so far, so they are sampled at least once
+    def append(self, transition):
+        position = self.position
+        super().append(transition)
+        self.tree.update([position], [self.max_priority ** self.alpha])
+
+    # Stratified sampling, one value in each of batch_size equal segments of the total priority
+    def sample(self):
+        total = self.tree.total()
+        segment = total / self.batch_size
+        values = (np.arange(self.batch_size) + np.random.uniform(size=self.batch_size)) * segment
+        indices = np.minimum(self.tree.find(np.minimum(values, np.nextafter(total, 0))), self.size - 1)
+        self.batch_indices[:] = indices
+
+        # Importance-sampling weights, normalised by the largest one of the batch
+        probabilities = self.tree.tree[indices + self.tree.leaves] / total
+        weights = (self.size * probabilities) ** -self.beta
+        self.batch_weights[:] = weights / weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        return self.gather()
+
+    def update_priorities(self, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(self.batch_indices, priorities ** self.alpha)
+
+
+# Copy of a model whose layers compute under the given keras mixed precision policy (e.g. 'mixed_bfloat16')
+# The output layer stays in float32, so Q values and losses keep full precision
+def clone_model(model, policy=None):
+    if policy is None:
+        return keras.models.clone_model(model)
+
+    def clone_layer(layer):
+        config = layer.get_config()
+        config['dtype'] = 'float32' if layer is model.layers[-1] else policy
+        return layer.__class__.from_config(config)
+
+    return keras.models.clone_model(model, clone_function=clone_layer)
+
+
+# Optional params:
+#   jit_compile: compile the training step and inference with XLA, defaults to the HEXAI_JIT environment variable
+#   precision: mixed precision policy of the networks ('mixed_bfloat16' or 'mixed_float16'), defaults to the
+#              HEXAI_PRECISION environment variable, float32 when unset
+#   tau: soft target updates, target = tau * online + (1 - tau) * target after every training step
+#        instead of copying the online network every update_target steps
 class DQNAgent:
 
     def __init__(self, model, weights, params):
 
+        # Compilation and precision modes, the environment variables enable them without changing the scripts
+        self.jit_compile = bool(params.get('jit_compile', os.environ.get('HEXAI_JIT', '0') not in ('', '0')))
+        self.precision = params.get('precision', os.environ.get('HEXAI_PRECISION') or None)
+        if self.precision == 'float32':
+            self.precision = None
+
+        # Identifiers such as 'mse' and 'sgd' are resolved here, the training step calls both directly
+        self.optimizer = keras.optimizers.get(params['optimizer'])
+        self.loss_function = keras.losses.get(params['loss'])
+
         # Online model
-        self.online = keras.models.clone_model(model)
+        self.online = clone_model(model, self.precision)
         self.online.set_weights(weights)
-        self.online.compile(optimizer=params['optimizer'],
-                            loss=params['loss'])
+        self.online.compile(optimizer=self.optimizer,
+                            loss=self.loss_function)
 
         # Target model
-        self.target = keras.models.clone_model(model)
+        self.target = clone_model(model, self.precision)
         self.target.set_weights(weights)
-        self.target.compile(optimizer=params['optimizer'],
-                            loss=params['loss'])
+        self.target.compile(optimizer=self.optimizer,
+                            loss=self.loss_function)
 
-        # Callback
-        self.callback = DQNCallback()
+        # Loss of every training step, after a placeholder so loss[-1] prints before the first step
+        # callback.loss is the same list, for scripts written when the losses came from a keras callback of fit
+        self.loss = ['unavailable']
+        self.callback = SimpleNamespace(loss=self.loss)
 
-        # Replay memory
-        self.replay_memory = deque(maxlen=params['memory_size'])
+        # Replay memory, prioritized replay is opt-in
+        # The priorities only live in memory, so a prioritized memory cannot be memory-mapped and resumed
+        self.prioritized = params.get('prioritized', False)
+        if self.prioritized and params.get('memory_path') is not None:
+            raise Exception("Prioritized replay does not support memory_path, its priorities would not be "
+                            "persisted by the checkpoints")
+
+        if self.prioritized:
+            self.replay_memory = PrioritizedReplayMemory(params['memory_size'], params['state_shape'],
+                                                         params['batch_size'],
+                                                         alpha=params.get('priority_alpha', 0.6),
+                                                         beta=params.get('priority_beta', 0.4),
+                                                         beta_steps=params.get('priority_beta_steps', 100000))
+        elif params.get('memory_path') is not None:
+            self.replay_memory = MemmapReplayMemory(params['memory_size'], params['state_shape'],
+                                                    params['batch_size'], params['memory_path'])
+        else:
+            self.replay_memory = ReplayMemory(params['memory_size'], params['state_shape'], params['batch_size'])
 
         # Store when to update the target network
         self.online_counter = 0
 
+        # Bumped whenever the online weights change, lets caches of the online outputs invalidate themselves
+        self.weights_version = 0
+
         # Save parameters
         self.minimum_memory_size = params['minimum_memory_size']
         self.batch_size = params['batch_size']
         self.state_shape = params['state_shape']
         self.action_shape = params['action_shape']
         self.update_target = params['update_target']
+        self.tau = params.get('tau')
         self.discount = params['discount']
 
+        # float16 gradients underflow without loss scaling, bfloat16 has the range of float32 and needs none
+        if self.precision == 'mixed_float16':
+            self.optimizer = keras.mixed_precision.LossScaleOptimizer(self.optimizer)
+
+        # Compiled graphs for the training step and for inference
+        self.train_step = tf.function(self.train_graph, jit_compile=self.jit_compile)
+        self.target_update = tf.function(self.target_graph)
+        self.q_function = tf.function(self.q_graph, jit_compile=self.jit_compile,
+                                      input_signature=[tf.TensorSpec((None, *self.state_shape), tf.float32)])
+
     # Append transition to memory
     def update_memory(self, transition):
         self.replay_memory.append(transition)
@@ -59,44 +322,112 @@ class DQNAgent:
             status = True
 
             # Get a random batch of transitions
-            batch = sample(self.replay_memory, self.batch_size)
+            with timer.phase('agent.replay_sample'):
+                start_states, actions, rewards, end_states, end_games = self.replay_memory.sample()
+
+            # Forward passes, targets and gradient step all run in a single graph call
+            with timer.phase('agent.train_step'):
+                loss, td_errors = self.train_step(start_states, actions, rewards, end_states, end_games,
+                                                  self.replay_memory.batch_weights)
+                self.loss.append(float(loss))
+                self.weights_version += 1
+
+            if self.prioritized:
+                with timer.phase('agent.priority_update'):
+                    self.replay_memory.update_priorities(td_errors.numpy())
 
-            # Now we need to compute the target values
-            start_states = np.array([transition[0] for transition in batch]).reshape((-1, *self.state_shape))
-            start_q = self.online.predict(start_states)
+            # Update counter
+            self.online_counter += 1
+
+            # Update target network, soft updates already ran inside the training step
+            if self.tau is None and self.online_counter >= self.update_target:
+                with timer.phase('agent.target_sync'):
+                    self.target_update(1.0)
+                self.online_counter = 0
+
+        return status
+
+    # Save the networks, the replay memory and the counters needed to resume training
+    # extra holds the state of the training loop (episode index, epsilon position...) and is returned on load
+    def save_checkpoint(self, path, **extra):
+        os.makedirs(path, exist_ok=True)
+        self.replay_memory.flush()
+        write_atomic(os.path.join(path, 'online.npz'), lambda file: np.savez(file, *self.online.get_weights()))
+        write_atomic(os.path.join(path, 'target.npz'), lambda file: np.savez(file, *self.target.get_weights()))
+        write_atomic(os.path.join(path, 'loss.npy'), lambda file: np.save(file, np.array(self.loss[1:])))
+
+        state = {'online_counter': self.online_counter, 'extra': extra}
+        write_atomic(os.path.join(path, 'agent.json'), lambda file: file.write(json.dumps(state).encode()))
+
+    # Restore a checkpoint written by save_checkpoint, returns its extra state or None if there is none
+    def load_checkpoint(self, path):
+        state_file = os.path.join(path, 'agent.json')
+        if not os.path.exists(state_file):
+            return None
 
-            end_states = np.array([transition[3] for transition in batch]).reshape((-1, *self.state_shape))
-            end_q = self.target.predict(end_states)
+        with open(state_file) as file:
+            state = json.load(file)
 
-            # We compute the target values based if we reach a terminal state or not
-            x = np.zeros((self.batch_size, *self.state_shape))
-            y = start_q
-            for idx, (start_state, action, reward, end_state, end_game) in enumerate(batch):
+        for model, name in ((self.online, 'online.npz'), (self.target, 'target.npz')):
+            with np.load(os.path.join(path, name)) as weights:
+                model.set_weights([weights[f'arr_{idx}'] for idx in range(len(weights.files))])
+        self.loss[1:] = np.load(os.path.join(path, 'loss.npy')).tolist()
+        self.online_counter = state['online_counter']
+        self.weights_version += 1
 
-                # If we reach endgame, Q from a future state is 0
-                if end_game:
-                    target_value = reward
+        return state['extra']
 
+    def train_graph(self, start_states, actions, rewards, end_states, end_games, weights):
+
+        # We compute the target values based if we reach a terminal state or not
+        # If we reach endgame, Q from a future state is 0
+        end_q = self.target(tf.cast(end_states, tf.float32), training=False)
+        target_values = rewards + self.discount * tf.reduce_max(end_q, axis=1) * tf.cast(~end_games, tf.float32)
+
+        with tf.GradientTape() as tape:
+            start_q = self.online(tf.cast(start_states, tf.float32), training=True)
+
+            # Only the entries of the taken actions differ from the prediction, so only they carry a gradient
+            indices = tf.stack([tf.range(tf.shape(actions)[0]), tf.cast(actions, tf.int32)], axis=1)
+            y = tf.tensor_scatter_nd_update(tf.stop_gradient(start_q), indices, target_values)
+            if isinstance(self.loss_function, keras.losses.Loss):
+                loss = self.loss_function(y, start_q, sample_weight=weights)
+            else:
+                # Plain loss functions such as the one of 'mse' return one value per sample
+                loss = tf.reduce_mean(self.loss_function(y, start_q) * tf.cast(weights, tf.float32))
+            if self.online.losses:
+                loss += tf.add_n(self.online.losses)
+
+            scaled_loss = loss
+            if self.precision == 'mixed_float16':
+                # Keras 3 unscales the gradients in apply_gradients, older versions need it done here
+                if hasattr(self.optimizer, 'get_scaled_loss'):
+                    scaled_loss = self.optimizer.get_scaled_loss(loss)
                 else:
-                    target_value = reward + self.discount * max(end_q[idx, :])
+                    scaled_loss = self.optimizer.scale_loss(loss)
 
-                x[idx, :] = start_state
-                y[idx, action] = target_value
+        gradients = tape.gradient(scaled_loss, self.online.trainable_variables)
+        if hasattr(self.optimizer, 'get_unscaled_gradients'):
+            gradients = self.optimizer.get_unscaled_gradients(gradients)
+        self.optimizer.apply_gradients(zip(gradients, self.online.trainable_variables))
 
-            # Now we fit on this minibatch
-            self.online.fit(x=x, y=y, batch_size=self.batch_size, verbose=0, shuffle=False,
-                            callbacks=[self.callback])
+        if self.tau is not None:
+            self.target_graph(self.tau)
 
-            # Update counter
-            self.online_counter += 1
+        return loss, target_values - tf.gather_nd(start_q, indices)
 
-            # Update target network
-            if self.online_counter >= self.update_target:
-                self.target.set_weights(self.online.get_weights())
-                self.online_counter = 0
+    # Move the target weights towards the online ones with variable assignments, tau = 1 copies them
+    def target_graph(self, tau):
+        for target, online in zip(self.target.weights, self.online.weights):
+            if tau == 1.0:
+                target.assign(online)
+            else:
+                target.assign(tau * online + (1 - tau) * target)
 
-        return status
+    def q_graph(self, states):
+        return self.online(states, training=False)
 
     # Get the Q values of the online network
+    @timed('agent.get_q')
     def get_q(self, state):
-        return self.online.predict(state.reshape(-1, *self.state_shape))
+        return self.q_function(np.asarray(state, dtype=np.float32).reshape((-1, *self.state_shape))).numpy()
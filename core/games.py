@@ -1,6 +1,16 @@
 import numpy as np
-import pygame as pg
-from pygame.locals import QUIT, K_UP, K_DOWN, K_LEFT, K_RIGHT, KEYDOWN, MOUSEBUTTONDOWN
+
+from core.timing import timed
+
+# pygame is only imported when a game window is opened, so the games can be used without it
+pg = None
+
+
+def load_pygame():
+    global pg
+    if pg is None:
+        import pygame
+        pg = pygame
 
 
 # Base Toy game
@@ -100,6 +110,7 @@ class Toy:
         self.place_element(self.reward, self.FRUIT)
 
     def window(self):
+        load_pygame()
         pg.init()
         self.display = pg.display.set_mode((self.display_width,
                                             self.display_height))
@@ -111,26 +122,26 @@ class Toy:
 
         while True:
             for event in pg.event.get():
-                if event.type == QUIT:
+                if event.type == pg.QUIT:
                     pg.display.quit()
                     pg.quit()
                     return
 
-                if event.type == KEYDOWN and not self.game_over:
+                if event.type == pg.KEYDOWN and not self.game_over:
 
-                    if event.key == K_LEFT:
+                    if event.key == pg.K_LEFT:
                         self.step(0)
 
-                    if event.key == K_UP:
+                    if event.key == pg.K_UP:
                         self.step(1)
 
-                    if event.key == K_RIGHT:
+                    if event.key == pg.K_RIGHT:
                         self.step(2)
 
-                    if event.key == K_DOWN:
+                    if event.key == pg.K_DOWN:
                         self.step(3)
 
-                if event.type == MOUSEBUTTONDOWN and self.game_over:
+                if event.type == pg.MOUSEBUTTONDOWN and self.game_over:
                     self.reset()
 
             if not self.game_over:
@@ -174,6 +185,7 @@ class BooleanToy(Toy):
         self.action_shape = (4, )
         self.ai = ai
 
+    @timed('toy.step')
     def step(self, move):
         return_code = super().step(move)
         return return_code * self.SCALE
@@ -213,12 +225,13 @@ class BooleanToy(Toy):
     def get_move_from_action(action):
         return action
 
-    def ai_loop(self, fps=15):
+    # recorder is an optional core.render.Recorder, called on every frame
+    def ai_loop(self, fps=15, recorder=None):
         self.window()
 
         while True:
             for event in pg.event.get():
-                if event.type == QUIT:
+                if event.type == pg.QUIT:
                     pg.display.quit()
                     pg.quit()
                     return
@@ -228,6 +241,8 @@ class BooleanToy(Toy):
                 self.step(ai_move)
                 self.display.fill(self.WHITE)
                 self.draw()
+                if recorder is not None:
+                    recorder(self)
 
             else:
                 self.display.fill(self.BLACK)
@@ -236,3 +251,81 @@ class BooleanToy(Toy):
 
             pg.display.update()
             self.FPS.tick(fps)
+
+
+# N BooleanToy games stepped together, positions are (n, 2) integer arrays of (row, column)
+class VecBooleanToy:
+
+    REWARD = Toy.REWARD
+    SCALE = BooleanToy.SCALE
+    MOVES = np.array(Toy.MOVE_TUPLE)
+
+    def __init__(self, n, width, height, auto_reset=True):
+        self.n = n
+        self.width = width
+        self.height = height
+        self.auto_reset = auto_reset
+        self.state_shape = (8, )
+        self.action_shape = (4, )
+
+        self.player = np.zeros((n, 2), dtype=np.int64)
+        self.reward = np.zeros((n, 2), dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.frames_counter = np.zeros(n, dtype=np.int64)
+        self.game_over = np.zeros(n, dtype=bool)
+        self.reset()
+
+    # Place the fruit uniformly on any cell but the player's one
+    def generate_reward(self, mask):
+        player = self.player[mask, 0] * self.width + self.player[mask, 1]
+        cell = np.random.randint(self.width * self.height - 1, size=len(player))
+        cell += cell >= player
+        self.reward[mask, 0], self.reward[mask, 1] = np.divmod(cell, self.width)
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+
+        count = np.count_nonzero(mask)
+        self.player[mask, 0] = np.random.randint(self.height, size=count)
+        self.player[mask, 1] = np.random.randint(self.width, size=count)
+        self.generate_reward(mask)
+        self.score[mask] = 0
+        self.frames_counter[mask] = 0
+        self.game_over[mask] = False
+
+    # Step every running game, games already over are left untouched and get a reward of 0
+    def step(self, moves):
+        active = ~self.game_over
+        self.player[active] += self.MOVES[np.asarray(moves)[active]]
+
+        valid = ((0 <= self.player[:, 0]) & (self.player[:, 0] < self.height) &
+                 (0 <= self.player[:, 1]) & (self.player[:, 1] < self.width))
+        crash = active & ~valid
+        eaten = active & valid & np.all(self.player == self.reward, axis=1)
+
+        rewards = (eaten.astype(np.int64) - crash) * self.SCALE
+        self.game_over |= crash
+        self.score += eaten * self.REWARD
+        self.frames_counter += active & valid
+        if np.any(eaten):
+            self.generate_reward(eaten)
+
+        state = self.get_state_from_board()
+        game_over = self.game_over.copy()
+        if self.auto_reset and np.any(game_over):
+            self.reset(game_over)
+
+        return state, rewards, game_over
+
+    # Same features as BooleanToy.get_state_from_board, for all games at once
+    def get_state_from_board(self):
+        player = self.player[:, ::-1]
+        reward = self.reward[:, ::-1]
+
+        state = np.empty((self.n, 8))
+        state[:, 0:2] = player == 0
+        state[:, 2:4] = player == (self.width - 1, self.height - 1)
+        state[:, 4:6] = reward < player
+        state[:, 6:8] = reward > player
+        return state
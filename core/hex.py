@@ -1,87 +1,530 @@
+import threading
 import numpy as np
-from collections import defaultdict
-import pygame as pg
-import pygame.locals as pl
+
+from core.timing import timed
+
+# pygame is only imported by the GUI classes, so the engines can be used without it
+pg = None
+pl = None
+
+
+def load_pygame():
+    global pg, pl
+    if pg is None:
+        import pygame
+        import pygame.locals
+        pg, pl = pygame, pygame.locals
+
 
 colors = {1: [255, 0, 0], 2: [0, 0, 255]}
 
+# Zobrist keys of every (player, position) pair, shared by all boards of a size and stable across processes
+# Kept both as an array and as nested lists of Python ints, which are faster to index one key at a time
+zobrist_tables = dict()
+
 
+def zobrist_table(x, y, as_list=False):
+    if (x, y) not in zobrist_tables:
+        table = np.random.default_rng(x * 1000 + y).integers(1, 2 ** 63, size=(3, x * y), dtype=np.uint64)
+        table[0] = 0
+        zobrist_tables[x, y] = table, table.tolist()
+    return zobrist_tables[x, y][as_list]
+
+
+# Edge-to-edge connectivity of one player, kept in a union-find over the padded board cells
+# Both edges of the player are virtual nodes, every edge cell hangs directly below its edge
 class HexPlayer:
-    def __init__(self, x, y, player):
+    def __init__(self, x, y, player, undo=False):
         self.win = False
-        self.board = np.zeros((x + 2, y + 2), dtype=np.int8)
-        self.groups = defaultdict(list)
-        self.available_group = 3
+        self.width = y + 2
+        size = (x + 2) * self.width
+        self.start = size
+        self.end = size + 1
+        self.parent = list(range(size + 2))
+        self.rank = [0] * (size + 2)
+        self.stones = bytearray(size)  # 1 on the cells owned by this player, edges included
         if player == 'x':
-            self.board[0] = 1
-            self.board[-1] = 2
+            start_cells = range(0, self.width)
+            end_cells = range(size - self.width, size)
         elif player == 'y':
-            self.board[:, 0] = 1
-            self.board[:, -1] = 2
+            start_cells = range(0, size, self.width)
+            end_cells = range(self.width - 1, size, self.width)
         else:
             raise Exception()
 
-    def find_surrounding_groups(self, x, y):
-        groups = set()
-        for _x, _y in [(x, y - 1), (x + 1, y - 1), (x - 1, y), (x + 1, y), (x - 1, y + 1), (x, y + 1)]:
-            group = self.board[_x, _y]
-            if group != 0:
-                groups.add(group)
-        return sorted(groups)
-
-    def add_point_to_group(self, x, y, to_group):
-        self.groups[to_group].append((x, y))
-        self.board[(x, y)] = to_group
+        for edge, cells in ((self.start, start_cells), (self.end, end_cells)):
+            for cell in cells:
+                self.stones[cell] = 1
+                self.parent[cell] = edge
+        self.rank[self.start] = self.rank[self.end] = 1
+        self.history = [] if undo else None  # (cell, win before, links added) of every stone, for undo
+
+        # Flat offsets of (x, y - 1), (x + 1, y - 1), (x - 1, y), (x + 1, y), (x - 1, y + 1), (x, y + 1)
+        self.offsets = (-1, self.width - 1, -self.width, self.width, 1 - self.width, 1)
+
+    # Paths are only compressed while undo is off, the logged unions are then undone by resetting the links
+    # they added, and union by rank alone keeps the trees logarithmic in depth
+    # Compressing before undo is enabled is safe, as undo never goes back further than that
+    def find(self, node):
+        parent = self.parent
+        if self.history is None:
+            while parent[node] != node:
+                # Path halving
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+        else:
+            while parent[node] != node:
+                node = parent[node]
+        return node
+
+    def enable_undo(self):
+        if self.history is None:
+            self.history = []
+
+    # Returns the link added, as (root attached, new parent, whether the rank grew), or None
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return None
+
+        # Union by rank
+        if self.rank[a] < self.rank[b]:
+            a, b = b, a
+        self.parent[b] = a
+        if self.rank[a] == self.rank[b]:
+            self.rank[a] += 1
+            return b, a, True
+        return b, a, False
 
-    def merge_group(self, from_group, to_group):
-        for x, y in self.groups[from_group]:
-            self.add_point_to_group(x, y, to_group)
+    def find_surrounding_groups(self, x, y):
+        cell = x * self.width + y
+        return sorted({self.find(cell + offset) for offset in self.offsets if self.stones[cell + offset]})
 
     def place_stone(self, x, y):
-        found_groups = self.find_surrounding_groups(x, y)
-        if len(found_groups) == 0:
-            self.add_point_to_group(x, y, self.available_group)
-            self.available_group += 1
-        elif found_groups[:2] == [1, 2]:
-            self.win = True
-        else:
-            to_group = found_groups[0]
-            self.add_point_to_group(x, y, to_group)
-            for from_group in found_groups[1:]:
-                self.merge_group(from_group, to_group)
+        cell = x * self.width + y
+        self.stones[cell] = 1
+        if self.history is None:
+            for offset in self.offsets:
+                if self.stones[cell + offset]:
+                    self.union(cell, cell + offset)
 
+        else:
+            links = []
+            for offset in self.offsets:
+                if self.stones[cell + offset]:
+                    link = self.union(cell, cell + offset)
+                    if link is not None:
+                        links.append(link)
+            self.history.append((cell, self.win, links))
+
+        if self.find(self.start) == self.find(self.end):
+            self.win = True
 
+    # Take back the last stone placed, its links are removed in reverse order
+    def undo(self):
+        cell, win, links = self.history.pop()
+        for child, root, grew in reversed(links):
+            self.parent[child] = child
+            if grew:
+                self.rank[root] -= 1
+        self.stones[cell] = 0
+        self.win = win
+
+    def copy(self):
+        player = HexPlayer.__new__(HexPlayer)
+        player.__dict__.update(self.__dict__)
+        player.parent = self.parent[:]
+        player.rank = self.rank[:]
+        player.stones = self.stones[:]
+        if self.history is not None:
+            player.history = self.history[:]
+        return player
+
+
+# With undo, play logs what it changes so that undo can take the moves back
+# The log is off by default to keep boards small, snapshot turns it on from that point
 class HexBoard:
-    def __init__(self, x, y):
+    def __init__(self, x, y, undo=False):
         self.x = x
         self.y = y
 
         self.board = np.zeros((x + 2, y + 2), dtype=np.int8)
-        self.players = [None, HexPlayer(x, y, 'x'), HexPlayer(x, y, 'y')]  # hacky: 1-based index
+        self.players = [None, HexPlayer(x, y, 'x', undo), HexPlayer(x, y, 'y', undo)]  # hacky: 1-based index
         self.board[[0, -1]] = 1
         self.board[:, [0, -1]] = 2
         self.winner = None
         self.crash = False
 
+        # Empty cells, kept up to date by play
+        # empty lists the free positions in any order and empty_index is the slot of each position in it
+        self.legal = np.ones(x * y, dtype=bool)
+        self.empty = list(range(x * y))
+        self.empty_index = list(range(x * y))
+        self.moves = 0
+
+        # Zobrist hash of the position and of the position rotated by 180 degrees
+        # The rotation maps position p to x * y - 1 - p and keeps each player's edges
+        self.zobrist = zobrist_table(x, y, as_list=True)
+        self.hash = 0
+        self.rotated_hash = 0
+
+        # (player, position, slot in empty, winner, crash) before every play, position is None for a crash
+        self.history = [] if undo else None
+
+    @timed('hex.play')
     def play(self, player_no, x, y):
         current_player = self.players[player_no]
         if self.board[x, y] != 0:
+            if self.history is not None:
+                self.history.append((player_no, None, None, self.winner, self.crash))
             self.crash = True
 
         else:
             self.board[x, y] = player_no
+            position = int((x - 1) * self.y + y - 1)
+            if self.history is not None:
+                self.history.append((player_no, position, self.empty_index[position], self.winner, self.crash))
+            self.remove_empty(position)
+            self.moves += 1
+            self.hash ^= self.zobrist[player_no][position]
+            self.rotated_hash ^= self.zobrist[player_no][-1 - position]
             current_player.place_stone(x, y)
             if current_player.win:
                 self.winner = player_no
 
-    def get_state(self):
-        return self.board[1:-1, 1:-1].copy().reshape((1, self.x, self.y, 1))
+    # Swap the position with the last empty one and drop it
+    def remove_empty(self, position):
+        self.legal[position] = False
+        index = self.empty_index[position]
+        last = self.empty.pop()
+        if last != position:
+            self.empty[index] = last
+            self.empty_index[last] = index
+
+    # Take back the last play, crashes included
+    def undo(self):
+        if not self.history:
+            raise Exception("No play to undo, create the board with undo=True or take a snapshot first")
+        player_no, position, index, self.winner, self.crash = self.history.pop()
+        if position is None:
+            return
+
+        x, y = self.get_xy(position)
+        self.board[x, y] = 0
+        self.players[player_no].undo()
+        self.moves -= 1
+        self.hash ^= self.zobrist[player_no][position]
+        self.rotated_hash ^= self.zobrist[player_no][-1 - position]
+
+        # Reverse remove_empty, so empty is restored in the same order
+        self.legal[position] = True
+        self.empty_index[position] = index
+        if index == len(self.empty):
+            self.empty.append(position)
+        else:
+            last = self.empty[index]
+            self.empty[index] = position
+            self.empty_index[last] = len(self.empty)
+            self.empty.append(last)
+
+    # Snapshots are the length of the history, restore undoes the plays made since
+    def snapshot(self):
+        if self.history is None:
+            self.history = []
+            self.players[1].enable_undo()
+            self.players[2].enable_undo()
+        return len(self.history)
+
+    def restore(self, snapshot):
+        while len(self.history) > snapshot:
+            self.undo()
+
+    # Independent copy, much cheaper than copy.deepcopy
+    def copy(self):
+        board = HexBoard.__new__(HexBoard)
+        board.__dict__.update(self.__dict__)
+        board.board = self.board.copy()
+        board.players = [None, self.players[1].copy(), self.players[2].copy()]
+        board.legal = self.legal.copy()
+        board.empty = self.empty[:]
+        board.empty_index = self.empty_index[:]
+        if self.history is not None:
+            board.history = self.history[:]
+        return board
+
+    # A read-only view is returned when copy is False, it changes with the board
+    def get_state(self, copy=True):
+        if copy:
+            return self.board[1:-1, 1:-1].copy().reshape((1, self.x, self.y, 1))
+
+        state = self.board[1:-1, 1:-1].reshape((1, self.x, self.y, 1))
+        state.flags.writeable = False
+        return state
+
+    def get_xy(self, position):
+        return [position // self.y + 1, position % self.y + 1]
+
+    def get_legal(self):
+        return np.flatnonzero(self.legal)
+
+    def is_full(self):
+        return not self.empty
+
+    # Key of the position up to the 180 degree rotation, and whether the board is the rotated one
+    def canonical_key(self):
+        if self.rotated_hash < self.hash:
+            return self.rotated_hash, True
+        return self.hash, False
+
+    def random_legal(self):
+        return self.empty[np.random.randint(len(self.empty))]
+
+
+# Masks shared by every BitHexBoard of a given size
+# Cell (i, j) of the interior is bit i * (y + 1) + j, the extra column keeps shifts from wrapping rows
+class BitMasks:
+    cache = dict()
+
+    def __init__(self, x, y):
+        self.width = y + 1
+        self.cells = 0
+        for i in range(x):
+            self.cells |= ((1 << y) - 1) << (i * self.width)
+
+        # Edges to connect for player 1 (rows) and player 2 (columns)
+        first_col = sum(1 << (i * self.width) for i in range(x))
+        self.edges = [None,
+                      ((1 << y) - 1, ((1 << y) - 1) << ((x - 1) * self.width)),
+                      (first_col, first_col << (y - 1))]
+
+        # Neighbour mask of every cell, in the six directions of find_surrounding_groups
+        self.neighbours = [self.dilate(1 << bit) & ~(1 << bit) for bit in range(x * self.width)]
+        self.nbytes = (x * self.width + 7) // 8
+
+    @classmethod
+    def get(cls, x, y):
+        x, y = int(x), int(y)
+        if (x, y) not in cls.cache:
+            cls.cache[x, y] = cls(x, y)
+        return cls.cache[x, y]
+
+    def dilate(self, bits):
+        w = self.width
+        return (bits | bits << 1 | bits >> 1 | bits << w | bits >> w | bits << (w - 1) | bits >> (w - 1)) & self.cells
+
+
+# HexBoard with the stones of each player stored as the bits of a Python int
+class BitHexBoard:
+    def __init__(self, x, y):
+        # Shifts on NumPy integers overflow, the masks need Python ints
+        x, y = int(x), int(y)
+        self.x = x
+        self.y = y
+
+        self.masks = BitMasks.get(x, y)
+        self.stones = [None, 0, 0]  # hacky: 1-based index
+        self.winner = None
+        self.crash = False
+
+        # Zobrist hashes as in HexBoard, so QCache works with both boards
+        self.zobrist = zobrist_table(x, y, as_list=True)
+        self.hash = 0
+        self.rotated_hash = 0
+
+    @timed('bit_hex.play')
+    def play(self, player_no, x, y):
+        index = int((x - 1) * self.masks.width + y - 1)
+        bit = 1 << index
+        if (self.stones[1] | self.stones[2]) & bit:
+            self.crash = True
+
+        else:
+            stones = self.stones[player_no] | bit
+            self.stones[player_no] = stones
+            position = int((x - 1) * self.y + y - 1)
+            self.hash ^= self.zobrist[player_no][position]
+            self.rotated_hash ^= self.zobrist[player_no][-1 - position]
+
+            # Bit-parallel flood fill of the group of the new stone, only needed if it touches a friendly stone
+            group = bit
+            if self.masks.neighbours[index] & stones:
+                while True:
+                    grown = self.masks.dilate(group) & stones
+                    if grown == group:
+                        break
+                    group = grown
+
+            first, last = self.masks.edges[player_no]
+            if group & first and group & last:
+                self.winner = player_no
+
+    # Interior cells as an (x, y) int8 array of player numbers
+    def to_array(self):
+        array = np.zeros((self.x, self.y), dtype=np.int8)
+        for player_no in (1, 2):
+            raw = np.frombuffer(self.stones[player_no].to_bytes(self.masks.nbytes, 'little'), dtype=np.uint8)
+            bits = np.unpackbits(raw, bitorder='little')[:self.x * self.masks.width]
+            array[bits.reshape((self.x, self.masks.width))[:, :self.y] == 1] = player_no
+        return array
+
+    # Padded board in the same layout as HexBoard.board
+    @property
+    def board(self):
+        board = np.zeros((self.x + 2, self.y + 2), dtype=np.int8)
+        board[[0, -1]] = 1
+        board[:, [0, -1]] = 2
+        board[1:-1, 1:-1] = self.to_array()
+        return board
+
+    # The state is always built from the bits, copy is accepted for compatibility with HexBoard
+    def get_state(self, copy=True):
+        return self.to_array().reshape((1, self.x, self.y, 1))
 
     def get_xy(self, position):
         return [position // self.y + 1, position % self.y + 1]
 
     def get_legal(self):
-        return np.where(self.board[1:-1, 1:-1].flatten() == 0)[0]
+        return np.where(self.to_array().flatten() == 0)[0]
+
+    def canonical_key(self):
+        if self.rotated_hash < self.hash:
+            return self.rotated_hash, True
+        return self.hash, False
+
+    def is_full(self):
+        return (self.stones[1] | self.stones[2]) == self.masks.cells
+
+    def random_legal(self):
+        return np.random.choice(self.get_legal())
+
+
+# Grow a stack of (n, x, y) masks by one step in the six hex directions used by find_surrounding_groups
+def hex_dilate(mask):
+    grown = mask.copy()
+    grown[:, :, 1:] |= mask[:, :, :-1]
+    grown[:, :, :-1] |= mask[:, :, 1:]
+    grown[:, 1:, :] |= mask[:, :-1, :]
+    grown[:, :-1, :] |= mask[:, 1:, :]
+    grown[:, 1:, :-1] |= mask[:, :-1, 1:]
+    grown[:, :-1, 1:] |= mask[:, 1:, :-1]
+    return grown
+
+
+# Check which of a stack of (n, x, y) stone masks connect the two edges of a player
+def hex_connected(stones, player_no):
+    # Player 1 connects the first and last rows, player 2 the first and last columns
+    if player_no == 2:
+        stones = stones.transpose((0, 2, 1))
+
+    reach = np.zeros_like(stones)
+    reach[:, 0] = stones[:, 0]
+    while True:
+        grown = hex_dilate(reach) & stones
+        if np.array_equal(grown, reach):
+            break
+        reach = grown
+
+    return reach[:, -1].any(axis=1)
+
+
+# N boards stepped together, states are stacked along the first axis
+class VecHexBoard:
+    def __init__(self, n, x, y, auto_reset=True, reset_on_win=False):
+        self.n = n
+        self.x = x
+        self.y = y
+        self.auto_reset = auto_reset
+        self.reset_on_win = reset_on_win
+
+        self.board = np.zeros((n, x + 2, y + 2), dtype=np.int8)
+        self.winner = np.zeros(n, dtype=np.int8)  # 0 while nobody has won
+        self.crash = np.zeros(n, dtype=bool)
+
+        # Zobrist hashes as in HexBoard
+        self.zobrist = zobrist_table(x, y)
+        self.hash = np.zeros(n, dtype=np.uint64)
+        self.rotated_hash = np.zeros(n, dtype=np.uint64)
+        self.reset()
+
+    def reset(self, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+
+        self.board[mask] = 0
+        self.board[mask, 0] = 1
+        self.board[mask, -1] = 1
+        self.board[mask, :, 0] = 2
+        self.board[mask, :, -1] = 2
+        self.winner[mask] = 0
+        self.crash[mask] = False
+        self.hash[mask] = 0
+        self.rotated_hash[mask] = 0
+
+    # Play one move per board, positions are flat indices as in HexBoard.get_xy
+    # Boards outside mask are left untouched
+    @timed('vec_hex.play')
+    def play(self, player_no, positions, mask=None):
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+
+        positions = np.asarray(positions)
+        rows = positions // self.y + 1
+        cols = positions % self.y + 1
+        boards = np.arange(self.n)
+
+        occupied = self.board[boards, rows, cols] != 0
+        crash = mask & occupied
+        placed = mask & ~occupied
+        self.board[boards[placed], rows[placed], cols[placed]] = player_no
+        self.hash[placed] ^= self.zobrist[player_no, positions[placed]]
+        self.rotated_hash[placed] ^= self.zobrist[player_no, self.x * self.y - 1 - positions[placed]]
+
+        # Only boards that just got a stone and have no winner yet can change their winner
+        check = placed & (self.winner == 0)
+        if np.any(check):
+            stones = self.board[check, 1:-1, 1:-1] == player_no
+            won = np.flatnonzero(check)[hex_connected(stones, player_no)]
+            self.winner[won] = player_no
+
+        self.crash |= crash
+        winner = self.winner.copy()
+        full = self.is_full()
+        state = self.get_state()
+
+        if self.auto_reset:
+            done = crash | full
+            if self.reset_on_win:
+                done |= winner != 0
+            self.reset(done)
+
+        return state, crash, winner, full
+
+    def get_state(self):
+        return self.board[:, 1:-1, 1:-1].copy().reshape((self.n, self.x, self.y, 1))
+
+    def get_xy(self, positions):
+        positions = np.asarray(positions)
+        return np.stack([positions // self.y + 1, positions % self.y + 1], axis=-1)
+
+    # Boolean mask of shape (n, x * y) with the empty cells of every board
+    def get_legal(self):
+        return self.board[:, 1:-1, 1:-1].reshape((self.n, -1)) == 0
+
+    def is_full(self):
+        return ~np.any(self.get_legal(), axis=1)
+
+    def canonical_keys(self):
+        rotated = self.rotated_hash < self.hash
+        return np.where(rotated, self.rotated_hash, self.hash), rotated
+
+    # Uniformly random legal position for every board, -1 on full boards
+    def random_legal(self):
+        legal = self.get_legal()
+        keys = np.random.uniform(size=legal.shape)
+        keys[~legal] = -1
+        positions = np.argmax(keys, axis=1)
+        positions[~np.any(legal, axis=1)] = -1
+        return positions
 
 
 class HexTextInterface:
@@ -121,6 +564,7 @@ class HexPVPGUI:
         self.square_size = size
         self.rects = dict()
         # Pygame stuff:
+        load_pygame()
         pg.init()
         self.FPS = pg.time.Clock()
         for i in range(y):
@@ -188,17 +632,26 @@ class HexPVPGUI:
         print(f"Player {self.game.winner} won!")
 
 
+# The AI moves are computed on a worker thread and posted back to the event loop as an event, so the window
+# keeps responding while a slow model or a search player thinks
+# Cells are blitted from pre-rendered tiles and only the changed rects are sent to the display
 class HexAIGUI:
-    def __init__(self, x, y, size, ai):
+    def __init__(self, x, y, size, ai, cache=None, fps=15):
         self.x, self.y = x, y
         self.ai = ai
+        self.cache = cache  # optional QCache wrapping ai
+        self.fps = fps
         self.game = HexBoard(x, y)
         self.endgame = False
+        self.thinking = False
         self.square_size = size
         self.rects = dict()
+        self.dirty = []
         # Pygame stuff:
+        load_pygame()
         pg.init()
         self.FPS = pg.time.Clock()
+        self.ai_event = pg.event.custom_type()
         for i in range(y):
             for j in range(x):
                 self.rects[j, i] = pg.Rect(
@@ -213,6 +666,12 @@ class HexAIGUI:
         self.display.fill((255, 255, 255))
         pg.display.update()
 
+        # Empty cell and stone of each player
+        self.tiles = dict()
+        for player_no, color in ((0, [100, 100, 100]), (1, colors[1]), (2, colors[2])):
+            self.tiles[player_no] = pg.Surface((self.square_size, self.square_size)).convert()
+            self.tiles[player_no].fill(color)
+
     def show(self):
         for k, line in enumerate(self.game.board):
             print(k * ' ', " ".join(str(x) if x != 0 else "." for x in line))
@@ -226,10 +685,16 @@ class HexAIGUI:
         pg.draw.line(self.display, colors[1], bottom_left, bottom_right, 5)
         pg.draw.line(self.display, colors[2], top_left, bottom_left, 5)
         pg.draw.line(self.display, colors[2], top_right, bottom_right, 5)
-        for rect in self.rects.values():
-            pg.draw.rect(self.display, [100, 100, 100], rect)
+        self.display.blits([(self.tiles[self.game.board[i + 1, j + 1]], rect) for (i, j), rect in self.rects.items()],
+                           doreturn=False)
+        self.dirty.clear()
         pg.display.update()
 
+    def draw_cell(self, i, j, player_no):
+        rect = self.rects[i, j]
+        self.display.blit(self.tiles[player_no], rect)
+        self.dirty.append(rect)
+
     def loop(self, ai_first=True):
 
         # AI plays first
@@ -237,15 +702,22 @@ class HexAIGUI:
             self.ai_turn()
 
         while True:
-            self.FPS.tick(15)
+            self.FPS.tick(self.fps)
             for event in pg.event.get():
                 if event.type == pl.QUIT:
                     pg.display.quit()
                     pg.quit()
                     return
 
-                if event.type == pl.MOUSEBUTTONDOWN and not self.endgame:
-                    self.mouse_callback(pg.mouse.get_pos())
+                if event.type == pl.MOUSEBUTTONDOWN and not self.endgame and not self.thinking:
+                    self.mouse_callback(event.pos)
+
+                if event.type == self.ai_event:
+                    self.ai_move(event)
+
+            if self.dirty:
+                pg.display.update(self.dirty)
+                self.dirty.clear()
 
     def mouse_callback(self, pos):
         for (i, j), rect in self.rects.items():
@@ -258,8 +730,7 @@ class HexAIGUI:
                     self.game.crash = False
 
                 else:
-                    pg.draw.rect(self.display, colors[2], self.rects[(i, j)])
-                    pg.display.update()
+                    self.draw_cell(i, j, 2)
                     if self.game.winner is not None:
                         self.endgame = True
                         print(f"Player {self.game.winner} won!")
@@ -269,18 +740,36 @@ class HexAIGUI:
 
                 return
 
+    # Start the AI on a worker thread, the board is left untouched until its move arrives
     def ai_turn(self):
+        self.thinking = True
+        threading.Thread(target=self.think, daemon=True).start()
+
+    def think(self):
+        try:
+            if self.cache is not None:
+                q = self.cache(self.game)
+            else:
+                q = self.ai(self.game.get_state(copy=False))
+            pg.event.post(pg.event.Event(self.ai_event, position=int(np.argmax(q)), error=None))
+
+        except Exception as error:
+            pg.event.post(pg.event.Event(self.ai_event, position=None, error=error))
+
+    def ai_move(self, event):
+        self.thinking = False
+        if event.error is not None:
+            raise event.error
+
         # AI plays
-        state = self.game.get_state()
-        move = self.game.get_xy(np.argmax(self.ai(state)))
+        move = self.game.get_xy(event.position)
         self.game.play(1, *move)
         if self.game.crash:
             print(f"AI has made a mistake!")
             self.endgame = True
 
         else:
-            pg.draw.rect(self.display, colors[1], self.rects[(move[0] - 1, move[1] - 1)])
-            pg.display.update()
+            self.draw_cell(move[0] - 1, move[1] - 1, 1)
             if self.game.winner is not None:
                 self.endgame = True
                 print(f"Player {self.game.winner} won!")
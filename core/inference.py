@@ -0,0 +1,132 @@
+import threading
+import queue
+import time
+from collections import deque
+from concurrent.futures import Future
+import numpy as np
+
+
+# Collects Q-value requests from many game loops and serves them with batched forward passes
+# model is anything called on a stack of states, e.g. a keras model or DQNAgent.get_q
+class InferenceServer:
+
+    def __init__(self, model, max_batch_size=256, max_latency=0.002, history=10000):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+
+        self.requests = queue.Queue()
+        self.thread = None
+        self.running = False
+        self.state_lock = threading.Lock()  # orders submit against stop, so no request is queued after the drain
+
+        # Recent per-request latencies (seconds) and achieved batch sizes
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.lock = threading.Lock()
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.loop, daemon=True)
+            self.thread.start()
+        return self
+
+    # Requests queued before stop are served, the ones left behind by a failed loop are failed
+    def stop(self):
+        if self.thread is not None:
+            with self.state_lock:
+                self.running = False
+                self.requests.put(None)
+            self.thread.join()
+            self.thread = None
+
+            while True:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is not None:
+                    request[1].set_exception(Exception("InferenceServer was stopped"))
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Queue a stack of states, the future resolves to their Q values
+    def submit(self, states):
+        future = Future()
+        with self.state_lock:
+            if not self.running:
+                raise Exception("InferenceServer is not running")
+            self.requests.put((np.asarray(states, dtype=np.float32), future, time.perf_counter()))
+        return future
+
+    # Blocking call with the same interface as the model, so the server can be used as the ai of HexAIGUI
+    def __call__(self, states):
+        return self.submit(states).result()
+
+    # Runs until the None queued by stop
+    def loop(self):
+        stopping = False
+        while not stopping:
+            request = self.requests.get()
+            if request is None:
+                break
+
+            # Gather requests until the batch is full or the oldest one reaches its deadline
+            batch = [request]
+            size = len(request[0])
+            deadline = request[2] + self.max_latency
+            while size < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+                size += len(request[0])
+
+            self.serve(batch)
+
+    def serve(self, batch):
+        try:
+            q = np.asarray(self.model(np.concatenate([states for states, _, _ in batch])))
+
+        except Exception as error:
+            for _, future, _ in batch:
+                future.set_exception(error)
+            return
+
+        # Split the outputs back to the requests
+        done = time.perf_counter()
+        start = 0
+        with self.lock:
+            self.batch_sizes.append(len(q))
+            for states, future, submitted in batch:
+                future.set_result(q[start:start + len(states)])
+                start += len(states)
+                self.latencies.append(done - submitted)
+
+    def stats(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = np.array(self.batch_sizes)
+
+        if not len(latencies):
+            return {'requests': 0, 'batches': 0}
+
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        return {'requests': len(latencies),
+                'batches': len(batch_sizes),
+                'latency_p50': float(p50),
+                'latency_p90': float(p90),
+                'latency_p99': float(p99),
+                'latency_max': float(latencies.max()),
+                'batch_size_mean': float(batch_sizes.mean()),
+                'batch_size_max': int(batch_sizes.max())}
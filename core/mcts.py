@@ -0,0 +1,196 @@
+import time
+import numpy as np
+
+from core.hex import HexBoard
+
+
+# Statistics of the moves are kept as arrays in the node, a child node is only created when its move is selected
+class Node:
+
+    def __init__(self, player_no, hash):
+        self.player_no = player_no  # player to move in this node
+        self.hash = hash
+        self.visits = 0
+        self.moves = None
+        self.priors = None
+        self.move_visits = None
+        self.move_values = None  # summed from the point of view of player_no
+        self.children = dict()  # slot of the move in moves -> Node
+        self.expanded = False
+        self.terminal = False
+        self.outcome = None  # value of a terminal node for player_no
+
+
+# Monte Carlo tree search guided by a Q network, used as prior and value estimate
+# Called like the network on a (1, x, y, 1) state where the searching player is to move, it returns
+# the visit counts of the root moves, so np.argmax picks the most visited one as with raw Q values
+# Leaves of batch_size simulations are collected with virtual loss and evaluated in a single forward pass
+# The network plays as player 1, positions of player 2 are transposed with the colours swapped
+class MCTSPlayer:
+
+    def __init__(self, model, player_no=1, simulations=200, time_limit=None, batch_size=16, c_puct=1.5,
+                 virtual_loss=1.0, temperature=1.0):
+        self.model = model
+        self.player_no = player_no
+        self.simulations = simulations
+        self.time_limit = time_limit
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.virtual_loss = virtual_loss
+        self.temperature = temperature
+        self.root = None
+        self.zobrist = None
+
+    def __call__(self, states):
+        return np.concatenate([self.search(state) for state in np.asarray(states)])
+
+    # Board with the stones of the state, the searching player to move
+    def board_from_state(self, state):
+        x, y = state.shape[:2]
+        if x != y:
+            raise Exception("MCTSPlayer needs a square board to evaluate both players with one network")
+
+        board = HexBoard(x, y)
+        for player_no in (1, 2):
+            for position in np.flatnonzero(state.reshape(-1) == player_no):
+                board.play(player_no, *board.get_xy(position))
+        return board
+
+    # Reuse the subtree of the new position if it was reached from the previous root
+    # Terminal nodes are never reused, the root always has to be searched
+    def find_root(self, board):
+        if self.root is not None:
+            frontier = [self.root]
+            for depth in range(3):
+                for node in frontier:
+                    if node.hash == board.hash and node.player_no == self.player_no and not node.terminal:
+                        return node
+                frontier = [child for node in frontier for child in node.children.values()]
+        return Node(self.player_no, board.hash)
+
+    def search(self, state):
+        board = self.board_from_state(state[..., 0] if state.ndim == 3 else state)
+        self.zobrist = board.zobrist
+        self.root = self.find_root(board)
+        if not self.root.expanded:
+            self.evaluate([(self.root, board.get_state(), board.get_legal())], board.x)
+
+        start = time.perf_counter()
+        done = 0
+        while (done < self.simulations if self.time_limit is None
+               else time.perf_counter() - start < self.time_limit):
+            self.simulate(board)
+            done += self.batch_size
+
+        # Without visits the priors still rank the legal moves, an all-zero vector would pick cell 0
+        counts = np.zeros((1, board.x * board.y))
+        if self.root.expanded:
+            if self.root.move_visits.sum() > 0:
+                counts[0, self.root.moves] = self.root.move_visits
+            else:
+                counts[0, self.root.moves] = self.root.priors
+        return counts
+
+    # Run batch_size selections, evaluate their leaves together and back the values up
+    # The board is branched with snapshot and restore, leaves keep their state and legal moves
+    def simulate(self, board):
+        leaves = dict()
+        paths = []
+        snapshot = board.snapshot()
+
+        # Ruleless games go on after a win, only a win reached below the root ends a path
+        decided = board.winner is not None
+        for k in range(self.batch_size):
+            node = self.root
+            path = []
+            while node.expanded and (node is self.root or not node.terminal):
+                slot, child = self.select(node)
+                board.play(node.player_no, *board.get_xy(node.moves[slot]))
+                path.append((node, slot))
+                node = child
+                if not decided and board.winner is not None:
+                    node.terminal = True
+                    node.outcome = -1.0
+
+            # Virtual loss keeps the next selections of the batch away from this path
+            for visited, slot in path:
+                visited.visits += self.virtual_loss
+                visited.move_visits[slot] += self.virtual_loss
+                visited.move_values[slot] -= self.virtual_loss
+            paths.append((path, node))
+            if not node.terminal and id(node) not in leaves:
+                leaves[id(node)] = (node, board.get_state(), board.get_legal())
+            board.restore(snapshot)
+
+        values = self.evaluate(list(leaves.values()), board.x)
+
+        for path, leaf in paths:
+            for visited, slot in path:
+                visited.visits -= self.virtual_loss
+                visited.move_visits[slot] -= self.virtual_loss
+                visited.move_values[slot] += self.virtual_loss
+
+            # Value for the player to move in the leaf, terminal leaves keep their outcome
+            value = leaf.outcome if leaf.terminal else values[id(leaf)]
+            for visited, slot in reversed(path):
+                value = -value
+                visited.visits += 1
+                visited.move_visits[slot] += 1
+                visited.move_values[slot] += value
+
+    # PUCT over the moves of the node, the child is created on its first selection
+    def select(self, node):
+        q = np.divide(node.move_values, node.move_visits, out=np.zeros(len(node.moves)),
+                      where=node.move_visits > 0)
+        scores = q + self.c_puct * node.priors * np.sqrt(max(node.visits, 1)) / (1 + node.move_visits)
+        slot = int(np.argmax(scores))
+
+        child = node.children.get(slot)
+        if child is None:
+            move = int(node.moves[slot])
+            child = Node(3 - node.player_no, node.hash ^ self.zobrist[node.player_no][move])
+            node.children[slot] = child
+        return slot, child
+
+    # Expand the leaves with priors from one batched forward pass, returns the value of each leaf
+    def evaluate(self, leaves, size):
+        if not leaves:
+            return dict()
+
+        states = np.stack([perspective(state[0], node.player_no) for node, state, _ in leaves])
+        q = np.asarray(self.model(states.astype(np.float32)))
+
+        values = dict()
+        for (node, _, legal), node_q in zip(leaves, q):
+            node_q = unperspective(node_q, size, node.player_no)
+            # A full board is only reached after the game was decided above the root, it scores as a draw
+            if not len(legal):
+                node.terminal = True
+                node.outcome = 0.0
+                continue
+
+            logits = node_q[legal] / self.temperature
+            priors = np.exp(logits - logits.max())
+            node.priors = priors / priors.sum()
+            node.moves = legal
+            node.move_visits = np.zeros(len(legal))
+            node.move_values = np.zeros(len(legal))
+            node.expanded = True
+            values[id(node)] = float(np.clip(node_q[legal].max(), -1, 1))
+
+        return values
+
+
+# State seen by the network when player_no is to move
+def perspective(state, player_no):
+    if player_no == 1:
+        return state
+    swapped = np.where(state == 0, 0, 3 - state).astype(state.dtype)
+    return swapped.transpose((1, 0, 2))
+
+
+# Q values of a perspective state back on the original board
+def unperspective(q, size, player_no):
+    if player_no == 1:
+        return q
+    return q.reshape((size, size)).T.reshape(-1)
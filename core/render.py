@@ -0,0 +1,156 @@
+import numpy as np
+
+from core.games import Toy
+from core.hex import colors
+
+
+# Off-screen renderers painting games into uint8 RGB arrays with NumPy, no window or pygame needed
+# Every renderer precomputes which cell each pixel belongs to, so a frame is two array lookups
+# render paints one game into an (height, width, 3) frame, render_batch the first games of a vector environment
+# into an (n, height, width, 3) array. Both reuse an internal buffer unless out is given, and the intermediate
+# colour codes always go to reused buffers, so recording does not allocate per frame
+
+
+# Toy and BooleanToy in the colours of their window, games over are painted black as the window does
+class ToyRenderer:
+
+    def __init__(self, width, height, cell=8, padding=1):
+        self.width = width
+        self.height = height
+        self.palette = np.array([Toy.WHITE, Toy.RED, Toy.GREEN, Toy.BLACK], dtype=np.uint8)
+
+        # Cell row of every pixel row and cell column of every pixel column, -1 on the padding
+        step = cell + padding
+        self.rows = np.full(height * step + padding, -1)
+        self.cols = np.full(width * step + padding, -1)
+        for k in range(height):
+            self.rows[padding + k * step:padding + k * step + cell] = k
+        for k in range(width):
+            self.cols[padding + k * step:padding + k * step + cell] = k
+
+        self.shape = (len(self.rows), len(self.cols), 3)
+        self.buffer = None
+        self.codes = None
+
+    # Frames of games given by player and fruit (row, column) positions, shapes (n, 2), and game over flags
+    def paint(self, player, reward, game_over, out=None):
+        if out is None:
+            if self.buffer is None or len(self.buffer) != len(player):
+                self.buffer = np.empty((len(player), *self.shape), dtype=np.uint8)
+            out = self.buffer
+
+        if self.codes is None or len(self.codes) != len(player):
+            self.codes = np.empty((len(player), *self.shape[:2]), dtype=np.uint8)
+        codes = self.codes
+        codes.fill(0)
+
+        rows = self.rows[None, :, None]
+        cols = self.cols[None, None, :]
+        codes[(rows == reward[:, 0, None, None]) & (cols == reward[:, 1, None, None])] = 2
+        codes[(rows == player[:, 0, None, None]) & (cols == player[:, 1, None, None])] = 1
+        codes[np.asarray(game_over, dtype=bool)] = 3
+        return np.take(self.palette, codes, axis=0, out=out)
+
+    def render(self, toy, out=None):
+        frames = self.paint(np.array([toy.player]), np.array([toy.reward]), [toy.game_over],
+                            None if out is None else out[None])
+        return frames[0]
+
+    # VecBooleanToy
+    def render_batch(self, toys, games=None, out=None):
+        games = toys.n if games is None else games
+        return self.paint(toys.player[:games], toys.reward[:games], toys.game_over[:games], out)
+
+
+# HexBoard, BitHexBoard and VecHexBoard drawn as the rhombus of the GUI, each row shifted by half a cell
+# The margins above and below the board take the colour of player 1 and the sides the colour of player 2
+class HexRenderer:
+
+    def __init__(self, x, y, cell=8, padding=1, margin=4):
+        self.x = x
+        self.y = y
+        self.palette = np.array([[100, 100, 100], colors[1], colors[2], [255, 255, 255]], dtype=np.uint8)
+
+        # Index of every pixel in the flattened board values, followed by the codes of the background,
+        # of player 1's edges and of player 2's edges
+        cells = x * y
+        background, edge_1, edge_2 = cells, cells + 1, cells + 2
+        self.extra = np.array([3, 1, 2], dtype=np.uint8)
+
+        step = cell + padding
+        height = 2 * margin + (x - 1) * step + cell
+        width = 2 * margin + (y - 1) * step + (x - 1) * step // 2 + cell
+        self.index = np.full((height, width), background)
+        self.index[:margin] = edge_1
+        self.index[height - margin:] = edge_1
+        for row in range(height - 2 * margin):
+            i = min(row // step, x - 1)
+            left = margin + i * step // 2
+            self.index[margin + row, :left] = edge_2
+            self.index[margin + row, left + (y - 1) * step + cell:] = edge_2
+            if row % step < cell:
+                for j in range(y):
+                    start = left + j * step
+                    self.index[margin + row, start:start + cell] = i * y + j
+
+        self.shape = (height, width, 3)
+        self.buffer = None
+        self.values = None
+        self.codes = None
+
+    # Frames of padded boards of shape (n, x + 2, y + 2), as HexBoard.board
+    def paint(self, boards, out=None):
+        if out is None:
+            if self.buffer is None or len(self.buffer) != len(boards):
+                self.buffer = np.empty((len(boards), *self.shape), dtype=np.uint8)
+            out = self.buffer
+
+        if self.values is None or len(self.values) != len(boards):
+            self.values = np.empty((len(boards), self.x * self.y + 3), dtype=np.uint8)
+            self.values[:, -3:] = self.extra
+            self.codes = np.empty((len(boards), *self.shape[:2]), dtype=np.uint8)
+
+        self.values[:, :-3] = boards[:, 1:-1, 1:-1].reshape((len(boards), -1))
+        np.take(self.values, self.index, axis=1, out=self.codes)
+        return np.take(self.palette, self.codes, axis=0, out=out)
+
+    def render(self, board, out=None):
+        return self.paint(board.board[None], None if out is None else out[None])[0]
+
+    # VecHexBoard
+    def render_batch(self, boards, games=None, out=None):
+        games = boards.n if games is None else games
+        return self.paint(boards.board[:games], out)
+
+
+# Records frames of a game, or of the first games of a vector environment, into a preallocated array
+# Pass it as recorder to BooleanToy.ai_loop or to the hex benchmarks, frames stops growing after max_frames
+# Vector environments with fewer than games games fill the first slots, the others stay black
+class Recorder:
+
+    def __init__(self, renderer, max_frames=1000, games=1):
+        self.renderer = renderer
+        self.games = games
+        self.buffer = np.zeros((max_frames, games, *renderer.shape), dtype=np.uint8)
+        self.count = 0
+
+    def __call__(self, game):
+        if self.count < len(self.buffer):
+            if hasattr(game, 'n'):  # vector environment
+                games = min(self.games, game.n)
+                self.renderer.render_batch(game, games, out=self.buffer[self.count, :games])
+            else:
+                self.renderer.render(game, out=self.buffer[self.count, 0])
+            self.count += 1
+
+    def reset(self):
+        self.count = 0
+
+    # (frames, games, height, width, 3) uint8 array of the recorded frames
+    @property
+    def frames(self):
+        return self.buffer[:self.count]
+
+    # Saved as .npy, frames[:, k] is a video of game k, e.g. for imageio.mimsave
+    def save(self, path):
+        np.save(path, self.frames)
@@ -0,0 +1,124 @@
+import json
+import numpy as np
+
+
+# Forward passes of the small keras Sequential models of the scripts in pure NumPy, so deploying does not need TensorFlow
+# export_model writes the layers and weights of a model to an .npz file and NumpyModel.load reads it back
+# A NumpyModel is called like the keras model, so it can be the ai of HexAIGUI and BooleanToy or go to the benchmarks
+
+
+def softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+activations = {'linear': lambda x: x,
+               'relu': lambda x: np.maximum(x, 0),
+               'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+               'tanh': np.tanh,
+               'softmax': softmax}
+
+
+def get_activation(config):
+    activation = config.get('activation', 'linear')
+    if isinstance(activation, dict):  # serialized activation object
+        activation = activation.get('config', {}).get('name', activation.get('class_name'))
+    if activation not in activations:
+        raise Exception(f"Activation {activation} is not supported by NumpyModel")
+    return activation
+
+
+def export_model(model, path):
+    layers = []
+    arrays = dict()
+    for layer in model.layers:
+        kind = type(layer).__name__
+        config = layer.get_config()
+
+        if kind == 'InputLayer':
+            continue
+
+        elif kind == 'Dense':
+            spec = {'type': kind, 'activation': get_activation(config)}
+
+        elif kind == 'Conv2D':
+            if config.get('data_format', 'channels_last') != 'channels_last' \
+                    or tuple(config.get('dilation_rate', (1, 1))) != (1, 1) or config.get('groups', 1) != 1:
+                raise Exception("NumpyModel only supports channels_last Conv2D layers without dilation or groups")
+            spec = {'type': kind,
+                    'activation': get_activation(config),
+                    'strides': list(config.get('strides', (1, 1))),
+                    'padding': config.get('padding', 'valid')}
+
+        elif kind == 'Flatten':
+            spec = {'type': kind}
+
+        else:
+            raise Exception(f"Layer {kind} is not supported by NumpyModel")
+
+        weights = layer.get_weights()
+        for name, weight in zip(('kernel', 'bias'), weights):
+            arrays[f'{len(layers)}.{name}'] = np.asarray(weight, dtype=np.float32)
+        layers.append(spec)
+
+    np.savez_compressed(path, layers=np.array(json.dumps(layers)), **arrays)
+
+
+def dense(x, spec, kernel, bias):
+    x = x @ kernel
+    if bias is not None:
+        x += bias
+    return activations[spec['activation']](x)
+
+
+def conv2d(x, spec, kernel, bias):
+    kh, kw = kernel.shape[:2]
+    sh, sw = spec['strides']
+    if spec['padding'] == 'same':
+        # Same split as TensorFlow, the extra row or column of padding goes after
+        pads = []
+        for size, k, s in ((x.shape[1], kh, sh), (x.shape[2], kw, sw)):
+            total = max((-(-size // s) - 1) * s + k - size, 0)
+            pads.append((total // 2, total - total // 2))
+        x = np.pad(x, [(0, 0), *pads, (0, 0)])
+
+    # (n, rows, cols, channels, kh, kw) windows, reduced against the (kh, kw, channels, filters) kernel
+    # Built with as_strided, sliding_window_view needs numpy 1.20 and requirements.txt pins 1.19
+    n, height, width, channels = x.shape
+    sn, sr, sc, sch = x.strides
+    windows = np.lib.stride_tricks.as_strided(
+        x, shape=(n, (height - kh) // sh + 1, (width - kw) // sw + 1, channels, kh, kw),
+        strides=(sn, sr * sh, sc * sw, sch, sr, sc), writeable=False)
+    x = np.einsum('nhwcij,ijcf->nhwf', windows, kernel, optimize=True)
+    if bias is not None:
+        x += bias
+    return activations[spec['activation']](x)
+
+
+def flatten(x, spec, kernel, bias):
+    return x.reshape((len(x), -1))
+
+
+layer_functions = {'Dense': dense, 'Conv2D': conv2d, 'Flatten': flatten}
+
+
+class NumpyModel:
+
+    def __init__(self, layers, arrays):
+        self.layers = []
+        for k, spec in enumerate(layers):
+            self.layers.append((layer_functions[spec['type']], spec,
+                                arrays.get(f'{k}.kernel'), arrays.get(f'{k}.bias')))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as file:
+            arrays = {name: file[name] for name in file.files}
+        return cls(json.loads(str(arrays.pop('layers'))), arrays)
+
+    # Outputs for a batch of states, as float32 like the keras model
+    def __call__(self, states):
+        x = np.asarray(states, dtype=np.float32)
+        for function, spec, kernel, bias in self.layers:
+            x = function(x, spec, kernel, bias)
+        return x
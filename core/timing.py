@@ -0,0 +1,134 @@
+import atexit
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import wraps
+
+
+# Wall time and call count of the phases of a training run
+# Disabled by default, phases then cost a flag check. Setting HEXAI_TIMING enables it at import,
+# with its value used as the path of the final report unless it is "1"
+class PhaseTimer:
+
+    def __init__(self):
+        self.enabled = False
+        self.print_period = None
+        self.report_path = None
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.start = None
+        self.last_print = None
+        self.null = nullcontext()
+
+    def enable(self, print_period=None, report_path=None):
+        self.enabled = True
+        self.print_period = print_period
+        self.start = self.last_print = time.perf_counter()
+        if report_path is not None and self.report_path is None:
+            atexit.register(self.dump)
+        self.report_path = report_path
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.totals.clear()
+        self.counts.clear()
+        self.start = self.last_print = time.perf_counter()
+
+    def phase(self, name):
+        if not self.enabled:
+            return self.null
+        return Phase(self, name)
+
+    def record(self, name, elapsed):
+        self.totals[name] += elapsed
+        self.counts[name] += 1
+
+        if self.print_period is not None:
+            now = time.perf_counter()
+            if now - self.last_print >= self.print_period:
+                self.last_print = now
+                print(self.summary())
+
+    def report(self):
+        wall = time.perf_counter() - self.start if self.start is not None else 0.0
+        return {'wall_time': wall,
+                'phases': {name: {'calls': self.counts[name],
+                                  'total': total,
+                                  'mean': total / self.counts[name],
+                                  'share': total / wall if wall else 0.0}
+                           for name, total in sorted(self.totals.items(), key=lambda item: -item[1])}}
+
+    def summary(self):
+        report = self.report()
+        lines = [f"Timing over {report['wall_time']:.1f}s:"]
+        for name, phase in report['phases'].items():
+            lines.append(f"  {name:<20} {phase['calls']:>10} calls {phase['total']:>10.3f}s "
+                         f"{phase['mean'] * 1e6:>12.1f}us/call {phase['share']:>7.1%}")
+        return "\n".join(lines)
+
+    # Machine-readable report, written to report_path unless another path is given
+    def dump(self, path=None):
+        path = path if path is not None else self.report_path
+        if path is not None:
+            with open(path, 'w') as file:
+                json.dump(self.report(), file, indent=2)
+
+
+class Phase:
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.begin = None
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timer.record(self.name, time.perf_counter() - self.begin)
+
+
+timer = PhaseTimer()
+if os.environ.get('HEXAI_TIMING'):
+    timer.enable(print_period=30, report_path=None if os.environ['HEXAI_TIMING'] == '1'
+                 else os.environ['HEXAI_TIMING'])
+
+
+# Decorator recording every call of a function as a phase
+def timed(name):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not timer.enabled:
+                return function(*args, **kwargs)
+            with Phase(timer, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Environment proxy timing step and reset, for environments defined outside this package such as gym
+class TimedEnv:
+
+    def __init__(self, env, name='gym'):
+        self.env = env
+        self.name = name
+
+    # Only called for attributes missing on the proxy, env itself can be missing while copying
+    def __getattr__(self, attribute):
+        if attribute == 'env':
+            raise AttributeError(attribute)
+        return getattr(self.env, attribute)
+
+    def step(self, action):
+        with timer.phase(self.name + '.step'):
+            return self.env.step(action)
+
+    def reset(self, *args, **kwargs):
+        with timer.phase(self.name + '.reset'):
+            return self.env.reset(*args, **kwargs)
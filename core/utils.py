@@ -1,6 +1,9 @@
 import numpy as np
+import time
+import copy
 
-from core.hex import HexBoard
+from core.hex import HexBoard, VecHexBoard
+from core.timing import timed
 
 
 def epsilon_function(e_max, e_min, episodes, period):
@@ -11,21 +14,68 @@ def epsilon_function(e_max, e_min, episodes, period):
     return np.tile(epsilon, number)[:episodes]
 
 
-def hex_benchmark(num_games, model):
+# Play all games in lockstep, with one model call per ply for every unfinished game
+# With a QCache, positions already evaluated are looked up instead of being sent to the model
+# recorder is an optional core.render.Recorder, called with the boards after every ply
+@timed('benchmark.hex')
+def hex_benchmark(num_games, model, board_size=3, return_rate=False, cache=None, recorder=None):
+    start = time.perf_counter()
+    boards = VecHexBoard(num_games, board_size, board_size, auto_reset=False)
+
+    # Opponent begins randomly
+    boards.play(2, boards.random_legal(), np.random.randint(0, 2, size=num_games).astype(bool))
+
+    live = ~boards.is_full()
+    moves = np.zeros(num_games, dtype=np.int64)
+    if recorder is not None:
+        recorder(boards)
+    while np.any(live):
+        if cache is not None:
+            q = cache.batch(boards, live)
+        else:
+            q = model(boards.get_state()[live].astype(np.float32))
+        moves[live] = np.argmax(np.asarray(q), axis=1)
+        boards.play(1, moves, live)
+        live &= ~boards.crash & ~boards.is_full()
+        if recorder is not None:
+            recorder(boards)
+
+        boards.play(2, boards.random_legal(), live)
+        live &= ~boards.is_full()
+        if recorder is not None:
+            recorder(boards)
+
+    mistake = int(np.sum(boards.crash))
+    if return_rate:
+        return mistake, num_games / (time.perf_counter() - start)
+
+    return mistake
+
+
+# Same benchmark played one game at a time, for board backends without a vectorised version
+@timed('benchmark.hex')
+def hex_benchmark_sequential(num_games, model, board_size=3, board_type=HexBoard, cache=None, recorder=None):
     mistake = 0
     for i in range(num_games):
-        board = HexBoard(3, 3)
+        board = board_type(board_size, board_size)
 
         if np.random.randint(0, 2):
-            board.play(2, *board.get_xy(np.random.choice(board.get_legal())))
+            board.play(2, *board.get_xy(board.random_legal()))
+        if recorder is not None:
+            recorder(board)
 
-        while not board.crash and np.any(board.get_legal()):
-            move = np.argmax(model(board.get_state()))
+        while not board.crash and not board.is_full():
+            q = cache(board) if cache is not None else model(board.get_state(copy=False))
+            move = np.argmax(q)
             board.play(1, *board.get_xy(move))
+            if recorder is not None:
+                recorder(board)
 
-            if np.any(board.get_legal()):
-                move = np.random.choice(board.get_legal())
+            if not board.is_full():
+                move = board.random_legal()
                 board.play(2, *board.get_xy(move))
+                if recorder is not None:
+                    recorder(board)
 
         if board.crash:
             mistake += 1
@@ -33,22 +83,42 @@ def hex_benchmark(num_games, model):
     return mistake
 
 
+# Run all attempts side by side, with one model call per timestep for the unfinished episodes
+# env is either a list of at least num_attempts environments or a single one that gets copied for every attempt
+@timed('benchmark.gym')
 def gym_benchmark(num_attempts, model, env, episode_length=200, render=False):
+    if isinstance(env, (list, tuple)):
+        if len(env) < num_attempts:
+            raise Exception(f"gym_benchmark needs num_attempts environments, got {len(env)} for {num_attempts} attempts")
+        envs = list(env[:num_attempts])
+
+    else:
+        envs = [env] + [copy.deepcopy(env) for _ in range(num_attempts - 1)]
+        for copied in envs[1:]:
+            copied.seed(np.random.randint(2 ** 31))
+
+    observations = np.stack([attempt.reset() for attempt in envs]).astype(np.float32)
+    live = np.ones(num_attempts, dtype=bool)
+
     fail = 0
-    for i in range(num_attempts):
-        observation = env.reset()
+    for j in range(episode_length):
+        if render and live[0]:
+            envs[0].render()
+
+        indices = np.flatnonzero(live)
+        actions = np.argmax(np.asarray(model(observations[indices])), axis=1)
+        for idx, action in zip(indices, actions):
+            observations[idx], reward, done, _ = envs[idx].step(action)
 
-        for j in range(episode_length):
-            if render:
-                env.render()
-            action = np.argmax(model(observation.reshape((1, -1))))
-            observation, reward, done, _ = env.step(action)
+            if done:
+                live[idx] = False
+                if j < episode_length - 1:
+                    fail += 1
 
-            if done and j < episode_length - 1:
-                fail += 1
-                break
+        if not np.any(live):
+            break
 
     if render:
-        env.close()
+        envs[0].close()
 
     return fail
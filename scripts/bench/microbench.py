@@ -0,0 +1,244 @@
+import argparse
+import copy
+import json
+import os
+import timeit
+import tracemalloc
+import numpy as np
+
+from core.hex import HexBoard, HexPlayer, BitHexBoard, VecHexBoard
+from core.games import BooleanToy, VecBooleanToy
+from core.render import ToyRenderer, HexRenderer
+
+
+# Microbenchmarks of the game engines and of the agent hot paths
+# Every benchmark reports operations per second and, where it makes sense, memory in bytes
+# Run with --save to store the results as the baseline, later runs are compared against it
+
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+board_sizes = (3, 7, 11, 19)
+batch_sizes = (32, 128, 512)
+vec_sizes = (64, 512)
+modes = ((True, None), (False, 'mixed_bfloat16'), (True, 'mixed_bfloat16'))
+
+
+# Operations per second of a callable performing ops operations per call
+# The first call is left out, so graph tracing and lazy allocations do not count
+def rate(function, ops=1, min_time=0.2):
+    function()
+    number, elapsed = timeit.Timer(function).autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timeit.Timer(function).timeit(number)
+    return number * ops / elapsed
+
+
+# Bytes still allocated per object after building count objects with build
+def memory(build, count=100):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    objects = [build() for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    del objects
+    return size / count
+
+
+# Board half filled with alternating random moves
+def half_board(board_type, size, seed=0):
+    board = board_type(size, size)
+    moves = np.random.RandomState(seed).permutation(size * size)
+    for k, move in enumerate(moves[:size * size // 2]):
+        board.play(k % 2 + 1, *board.get_xy(move))
+    return board
+
+
+def full_game(board_type, size, moves):
+    board = board_type(size, size)
+    for k, move in enumerate(moves):
+        board.play(k % 2 + 1, *board.get_xy(move))
+    return board
+
+
+def engine_benchmarks(results):
+    for size in board_sizes:
+        moves = np.random.RandomState(size).permutation(size * size).tolist()
+
+        for name, board_type in (('hex', HexBoard), ('bit_hex', BitHexBoard)):
+            results[f'{name}.play[{size}]'] = {
+                'ops_per_second': rate(lambda: full_game(board_type, size, moves), ops=size * size),
+                'bytes': memory(lambda: half_board(board_type, size))}
+
+            board = half_board(board_type, size)
+            results[f'{name}.get_legal[{size}]'] = {'ops_per_second': rate(board.get_legal)}
+            results[f'{name}.get_state[{size}]'] = {'ops_per_second': rate(board.get_state)}
+            results[f'{name}.is_full[{size}]'] = {'ops_per_second': rate(board.is_full)}
+            results[f'{name}.random_legal[{size}]'] = {'ops_per_second': rate(board.random_legal)}
+
+        # Branching a half filled board: full copies, and a move taken back with snapshot and restore
+        board = half_board(HexBoard, size)
+        results[f'hex.deepcopy[{size}]'] = {'ops_per_second': rate(lambda: copy.deepcopy(board))}
+        results[f'hex.copy[{size}]'] = {'ops_per_second': rate(board.copy)}
+
+        def branch():
+            snapshot = board.snapshot()
+            board.play(1, *board.get_xy(board.random_legal()))
+            board.restore(snapshot)
+
+        results[f'hex.play_restore[{size}]'] = {'ops_per_second': rate(branch)}
+
+        # Fill every row but the middle one, then close the gap so every stone merges two large groups
+        middle = size // 2 + 1
+        first = [(x, y) for x in range(1, size + 1) if x != middle for y in range(1, size + 1)]
+        gap = [(middle, y) for y in range(1, size + 1)]
+
+        def merges():
+            player = HexPlayer(size, size, 'y')
+            for x, y in first:
+                player.place_stone(x, y)
+            for x, y in gap:
+                player.place_stone(x, y)
+
+        results[f'hex_player.place_stone_merges[{size}]'] = {'ops_per_second': rate(merges, ops=size * size)}
+
+    for n in vec_sizes:
+        boards = VecHexBoard(n, 7, 7)
+        results[f'vec_hex.play[7x{n}]'] = {
+            'ops_per_second': rate(lambda: boards.play(1, boards.random_legal()), ops=n),
+            'bytes': boards.board.nbytes + boards.winner.nbytes + boards.crash.nbytes}
+
+        # Frames per second of the off-screen renderer
+        renderer = HexRenderer(7, 7)
+        results[f'render.hex[7x{n}]'] = {'ops_per_second': rate(lambda: renderer.render_batch(boards), ops=n),
+                                         'bytes': n * np.prod(renderer.shape)}
+
+
+def toy_benchmarks(results):
+    toy = BooleanToy(7, 7)
+    moves = np.random.RandomState(0).randint(4, size=1024).tolist()
+
+    def steps():
+        for move in moves:
+            toy.step(move)
+            if toy.game_over:
+                toy.reset()
+
+    results['toy.step'] = {'ops_per_second': rate(steps, ops=len(moves)), 'bytes': memory(lambda: BooleanToy(7, 7))}
+    results['toy.get_state_from_board'] = {'ops_per_second': rate(toy.get_state_from_board)}
+
+    for n in vec_sizes:
+        toys = VecBooleanToy(n, 7, 7)
+        results[f'vec_toy.step[{n}]'] = {'ops_per_second': rate(lambda: toys.step(np.random.randint(4, size=n)),
+                                                                ops=n)}
+
+        renderer = ToyRenderer(7, 7)
+        results[f'render.toy[{n}]'] = {'ops_per_second': rate(lambda: renderer.render_batch(toys), ops=n),
+                                       'bytes': n * np.prod(renderer.shape)}
+
+
+def agent_benchmarks(results):
+    from tensorflow import keras
+    from tensorflow.keras import layers
+    from core.dqn import DQNAgent
+
+    for size in (3, 7):
+        state_shape = (size, size, 1)
+        model = keras.Sequential(
+            [
+                layers.InputLayer(input_shape=state_shape),
+                layers.Conv2D(18, 2, activation="relu", name="c1"),
+                layers.Flatten(),
+                layers.Dense(size * size, activation="linear", name="output")
+            ]
+        )
+
+        for batch_size in batch_sizes:
+            params = {'memory_size': 4096,
+                      'minimum_memory_size': batch_size,
+                      'batch_size': batch_size,
+                      'state_shape': state_shape,
+                      'action_shape': (size * size, ),
+                      'update_target': 512,
+                      'discount': 0.99,
+                      'optimizer': keras.optimizers.SGD(),
+                      'loss': keras.losses.MeanSquaredError(),
+                      'jit_compile': False,
+                      'precision': None}
+            agent = DQNAgent(model, model.get_weights(), params)
+
+            state = half_board(HexBoard, size).get_state()
+            transition = [state, 0, 1, state, False]
+            key = f'[{size}x{size},{batch_size}]'
+            results['agent.update_memory' + key] = {'ops_per_second': rate(lambda: agent.update_memory(transition))}
+            results['agent.train' + key] = {'ops_per_second': rate(agent.train),
+                                            'bytes': agent.replay_memory.start_states.nbytes * 2}
+
+            states = np.repeat(state, batch_size, axis=0)
+            results['agent.get_q' + key] = {'ops_per_second': rate(lambda: agent.get_q(states), ops=batch_size)}
+
+            # Training steps under XLA and mixed precision, relative to the float32 graph above
+            for jit_compile, precision in modes:
+                params.update({'jit_compile': jit_compile, 'precision': precision, 'optimizer': keras.optimizers.SGD()})
+                mode_agent = DQNAgent(model, model.get_weights(), params)
+                for _ in range(batch_size):
+                    mode_agent.update_memory(transition)
+
+                mode = ','.join(name for name, on in (('xla', jit_compile), (precision, precision)) if on)
+                result = {'ops_per_second': rate(mode_agent.train)}
+                result['relative'] = result['ops_per_second'] / results['agent.train' + key]['ops_per_second']
+                results[f'agent.train[{size}x{size},{batch_size},{mode}]'] = result
+
+        results[f'agent.get_q[{size}x{size},1]'] = {'ops_per_second': rate(lambda: agent.get_q(state))}
+        results[f'agent.target_update[{size}x{size}]'] = {'ops_per_second': rate(lambda: agent.target_update(1.0))}
+
+
+groups = {'engine': engine_benchmarks, 'toy': toy_benchmarks, 'agent': agent_benchmarks}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        line = f"{name:<45} {result['ops_per_second']:>14.1f} ops/s"
+        if 'bytes' in result:
+            line += f" {result['bytes']:>12.0f} B"
+        if 'relative' in result:
+            line += f"   x{result['relative']:.2f} vs float32"
+
+        if name in baseline:
+            ratio = result['ops_per_second'] / baseline[name]['ops_per_second']
+            line += f"   x{ratio:.2f} vs baseline"
+            if ratio < 1 - tolerance:
+                line += "   REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Microbenchmarks of the game engines and the DQN agent")
+    parser.add_argument('--groups', nargs='+', default=list(groups), choices=list(groups))
+    parser.add_argument('--baseline', default=baseline_file)
+    parser.add_argument('--save', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    results = dict()
+    for group in args.groups:
+        groups[group](results)
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as file:
+            json.dump(baseline, file, indent=2, sort_keys=True)
+
+    elif regressions:
+        print(f"{len(regressions)} regressions")
+        exit(1)
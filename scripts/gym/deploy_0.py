@@ -1,9 +1,9 @@
-from tensorflow import keras
 import gym
 
+from core.runtime import NumpyModel
 from core.utils import gym_benchmark
 
 
-model = keras.models.load_model("./gmodel0_best")
+model = NumpyModel.load("./gmodel0_best.npz")
 env = gym.make('CartPole-v0')
 print(gym_benchmark(10, model, env, render=True))
@@ -6,10 +6,12 @@ import gym
 
 from core.dqn import DQNAgent
 from core.utils import epsilon_function, gym_benchmark
+from core.timing import TimedEnv
+from core.runtime import export_model
 
 
 # Gym
-env = gym.make("CartPole-v0")
+env = TimedEnv(gym.make("CartPole-v0"))
 benchmark = gym.make("CartPole-v0")
 
 # DQN Parameters
@@ -89,7 +91,7 @@ for episode in range(num_episodes):
         agent.train()
 
         if stop:
-            print(f"Episode: {episode}, Crash: {num_fail}, Moves: {i_episode}, Loss: {agent.callback.loss[-1]}")
+            print(f"Episode: {episode}, Crash: {num_fail}, Moves: {i_episode}, Loss: {agent.loss[-1]}")
 
             if i_episode < episode_length - 1:
                 num_fail += 1
@@ -106,10 +108,12 @@ for episode in range(num_episodes):
 
         if average == 0:
             keras.models.save_model(agent.online, "./gmodel0_best")
+            export_model(agent.online, "./gmodel0_best.npz")
 
             savemat('./gmodel0_best/loss.mat',
-                    {'loss': agent.callback.loss[1:], 'average_mistakes': average_mistakes})
+                    {'loss': agent.loss[1:], 'average_mistakes': average_mistakes})
 
 # Save model
 keras.models.save_model(agent.online, "./gmodel0")
-savemat('./gmodel0/loss.mat', {'loss': agent.callback.loss[1:], 'average_mistakes': average_mistakes})
+export_model(agent.online, "./gmodel0.npz")
+savemat('./gmodel0/loss.mat', {'loss': agent.loss[1:], 'average_mistakes': average_mistakes})
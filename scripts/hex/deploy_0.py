@@ -1,9 +1,8 @@
-from tensorflow import keras
-
 from core.hex import HexAIGUI
+from core.runtime import NumpyModel
 from core.utils import hex_benchmark
 
-model = keras.models.load_model("./hmodel0")
+model = NumpyModel.load("./hmodel0.npz")
 
 print(f"Mistakes: {hex_benchmark(10000, model)}")
 
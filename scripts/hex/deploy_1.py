@@ -1,9 +1,8 @@
-from tensorflow import keras
-
 from core.hex import HexAIGUI
+from core.runtime import NumpyModel
 from core.utils import hex_benchmark
 
-model = keras.models.load_model("./hmodel1")
+model = NumpyModel.load("./hmodel1.npz")
 
 print(f"Mistakes: {hex_benchmark(10000, model)}")
 
@@ -5,6 +5,7 @@ from scipy.io import savemat
 
 from core.hex import HexBoard
 from core.dqn import DQNAgent
+from core.runtime import export_model
 from core.utils import epsilon_function
 
 
@@ -35,6 +36,10 @@ epsilon_array = np.concatenate((epsilon_function(e_max, e_min, explore_episodes,
 reward = 1
 punishment = -1
 
+# Checkpoint parameters, a killed run restarts from its last checkpoint
+checkpoint_path = "./hmodel0_checkpoint"
+checkpoint_period = 500
+
 # Build base model
 base_model = keras.Sequential(
     [
@@ -55,16 +60,21 @@ dqn_params = {'memory_size': memory_size,
               'action_shape': action_shape,
               'update_target': update_target,
               'discount': discount,
+              'memory_path': checkpoint_path + "/memory",
               'optimizer': keras.optimizers.SGD(),
               'loss': keras.losses.MeanSquaredError()}
 
 # Initialize agents
 agent = DQNAgent(base_model, base_weights, dqn_params)
 
+# Resume from the last checkpoint if there is one
+checkpoint = agent.load_checkpoint(checkpoint_path)
+first_episode = 0 if checkpoint is None else checkpoint['episode'] + 1
+num_crash = 0 if checkpoint is None else checkpoint['num_crash']
+
 # Run episodes
 # In this script, we reward for completing the game both in winning and losing scenarios
-num_crash = 0
-for episode in range(num_episodes):
+for episode in range(first_episode, num_episodes):
 
     board = HexBoard(board_size, board_size)
 
@@ -73,7 +83,7 @@ for episode in range(num_episodes):
 
     # Opponent beginns randomly
     if np.random.randint(0, 2):
-        board.play(2, *board.get_xy(np.random.choice(board.get_legal())))
+        board.play(2, *board.get_xy(board.random_legal()))
 
     finished = False
     number_moves = 0
@@ -97,7 +107,7 @@ for episode in range(num_episodes):
             agent.update_memory(transition)
             num_crash += 1
 
-        elif not np.any(board.get_legal()):
+        elif board.is_full():
             finished = True
             end_state = board.get_state()
             transition = [start_state, move, reward, end_state, True]
@@ -106,9 +116,9 @@ for episode in range(num_episodes):
         # Continue playing (no matter if anyone has already won)
         else:
             # Choose random legal move
-            board.play(2, *board.get_xy(np.random.choice(board.get_legal())))
+            board.play(2, *board.get_xy(board.random_legal()))
 
-            if not np.any(board.get_legal()):
+            if board.is_full():
                 finished = True
 
             end_state = board.get_state()
@@ -119,8 +129,12 @@ for episode in range(num_episodes):
 
         number_moves += 1
 
-    print(f"Episode: {episode}, Moves: {number_moves}, Crash: {num_crash}, Loss: {agent.callback.loss[-1]}")
+    print(f"Episode: {episode}, Moves: {number_moves}, Crash: {num_crash}, Loss: {agent.loss[-1]}")
+
+    if not (episode + 1) % checkpoint_period:
+        agent.save_checkpoint(checkpoint_path, episode=episode, epsilon=epsilon, num_crash=num_crash)
 
 # Save model
 keras.models.save_model(agent.online, "./hmodel0")
-savemat('./hmodel0/loss.mat', {'loss': agent.callback.loss[1:]})
+export_model(agent.online, "./hmodel0.npz")
+savemat('./hmodel0/loss.mat', {'loss': agent.loss[1:]})
@@ -5,6 +5,7 @@ from scipy.io import savemat
 
 from core.hex import HexBoard
 from core.dqn import DQNAgent
+from core.runtime import export_model
 from core.utils import epsilon_function, hex_benchmark
 
 
@@ -77,7 +78,7 @@ for episode in range(num_episodes):
 
     # Opponent beginns randomly
     if np.random.randint(0, 2):
-        board.play(2, *board.get_xy(np.random.choice(board.get_legal())))
+        board.play(2, *board.get_xy(board.random_legal()))
 
     finished = False
     number_moves = 0
@@ -101,7 +102,7 @@ for episode in range(num_episodes):
             agent.update_memory(transition)
             num_crash += 1
 
-        elif not np.any(board.get_legal()):
+        elif board.is_full():
             finished = True
             end_state = board.get_state()
             transition = [start_state, move, reward, end_state, True]
@@ -110,9 +111,9 @@ for episode in range(num_episodes):
         # Continue playing (no matter if anyone has already won)
         else:
             # Choose random legal move
-            board.play(2, *board.get_xy(np.random.choice(board.get_legal())))
+            board.play(2, *board.get_xy(board.random_legal()))
 
-            if not np.any(board.get_legal()):
+            if board.is_full():
                 finished = True
 
             end_state = board.get_state()
@@ -128,9 +129,10 @@ for episode in range(num_episodes):
 
         number_moves += 1
 
-    print(f"Episode: {episode}, Moves: {number_moves}, Crash: {num_crash}, Loss: {agent.callback.loss[-1]},"
+    print(f"Episode: {episode}, Moves: {number_moves}, Crash: {num_crash}, Loss: {agent.loss[-1]},"
           f"Average: {average_mistakes[-1]}")
 
 # Save model
 keras.models.save_model(agent.online, "./hmodel1")
-savemat('./hmodel1/loss.mat', {'loss': agent.callback.loss[1:], 'average_mistakes': average_mistakes})
+export_model(agent.online, "./hmodel1.npz")
+savemat('./hmodel1/loss.mat', {'loss': agent.loss[1:], 'average_mistakes': average_mistakes})
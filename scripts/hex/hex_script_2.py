@@ -0,0 +1,85 @@
+from tensorflow import keras
+from tensorflow.keras import layers
+import numpy as np
+from scipy.io import savemat
+from functools import partial
+
+from core.hex import HexBoard
+from core.dqn import DQNAgent
+from core.runtime import export_model
+from core.distributed import ActorLearner, hex_episode
+from core.utils import epsilon_function, hex_benchmark
+
+
+# Same training as hex_script_1, with the episodes played by worker processes
+if __name__ == '__main__':
+
+    # Board parameters
+    board_size = 3
+    grid_size = board_size ** 2
+
+    # DQN Parameters
+    memory_size = 4096
+    minimum_memory_size = 128
+    batch_size = 128
+    state_shape = (board_size, board_size, 1)
+    action_shape = (grid_size, )
+    update_target = 512
+    discount = 0.99
+
+    # Network parameters
+    c1_filters = 18
+    c1_kernel = 2
+
+    # Learning parameters
+    num_episodes = 6000
+    explore_episodes = 4000
+    num_benchmark = 1000
+    e_max = 1
+    e_min = 0.1
+    epsilon_array = np.concatenate((epsilon_function(e_max, e_min, explore_episodes, explore_episodes),
+                                    [e_min] * 2000))
+
+    # Actor/learner parameters
+    num_workers = 4
+    sync_period = 64
+    train_ratio = 1  # training steps per transition, as hex_script_1 trains after every move
+
+    # Build base model
+    base_model = keras.Sequential(
+        [
+            layers.InputLayer(input_shape=state_shape),
+            layers.Conv2D(c1_filters, c1_kernel, activation="relu", name="c1", bias_initializer="normal"),
+            layers.Flatten(),
+            layers.Dense(grid_size, activation="linear", name="output")
+        ]
+    )
+
+    # Get base model weights and initialize parameters
+    base_weights = base_model.get_weights()
+    dqn_params = {'memory_size': memory_size,
+                  'minimum_memory_size': minimum_memory_size,
+                  'batch_size': batch_size,
+                  'state_shape': state_shape,
+                  'action_shape': action_shape,
+                  'update_target': update_target,
+                  'discount': discount,
+                  'optimizer': keras.optimizers.SGD(lr=1e-2),
+                  'loss': keras.losses.MeanSquaredError()}
+
+    # Initialize agents
+    agent = DQNAgent(base_model, base_weights, dqn_params)
+
+    # Run episodes on the workers and train on the learner
+    learner = ActorLearner(agent, partial(HexBoard, board_size, board_size), hex_episode, num_workers,
+                           epsilon_array, sync_period=sync_period, train_ratio=train_ratio)
+    metrics = learner.run(num_episodes)
+    print(metrics)
+
+    average_mistakes = hex_benchmark(num_benchmark, agent.online) / num_benchmark
+    print(f"Average: {average_mistakes}")
+
+    # Save model
+    keras.models.save_model(agent.online, "./hmodel2")
+    export_model(agent.online, "./hmodel2.npz")
+    savemat('./hmodel2/loss.mat', {'loss': agent.loss[1:], 'average_mistakes': average_mistakes})
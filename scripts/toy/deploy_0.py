@@ -1,8 +1,7 @@
-from tensorflow import keras
-
 from core.games import BooleanToy
+from core.runtime import NumpyModel
 
-model = keras.models.load_model("./hmodel0")
+model = NumpyModel.load("./hmodel0.npz")
 
 toy = BooleanToy(7, 7, model)
 
@@ -5,6 +5,7 @@ from tensorflow.keras import layers
 from core.utils import epsilon_function
 from core.dqn import DQNAgent
 from core.games import BooleanToy
+from core.runtime import export_model
 
 
 # Board parameters
@@ -96,7 +97,8 @@ for episode in range(num_episodes):
         agent.train()
 
     print(f"Episode: {episode}, Moves: {game.frames_counter}, Score: {game.score},"
-          f"Loss: {agent.callback.loss[-1]}")
+          f"Loss: {agent.loss[-1]}")
 
 # Save model
 keras.models.save_model(agent.online, "./hmodel0")
+export_model(agent.online, "./hmodel0.npz")